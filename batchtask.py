@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""
+batchtask.py -- Conference Central batch tasks over all the results of a
+    query
+
+Backfills, migrations and reconciliation jobs walk every entity of a kind,
+one batch per task request, each request queueing the next with the cursor
+where it stopped. A batch task is registered under its URL with the query
+it walks and the function applied to each batch; several queries of
+different kinds may share a URL. Requesting the URL as an administrator,
+or from a cron job, starts the task.
+
+"""
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+
+
+BATCH_SIZE = 100
+
+# Maps each task URL to a dict of kind -> (query, processBatch)
+_TASKS = {}
+
+
+def registerTask(url, query, processBatch):
+    """Registers a batch task.
+
+    Args:
+        url (string): URL that runs the task.
+        query (ndb.Query): Query whose results are processed. Its kind
+            must be unique among the queries registered at the URL.
+        processBatch (callable): Called with each list of at most
+            BATCH_SIZE results.
+    """
+    _TASKS.setdefault(url, {})[query.kind] = (query, processBatch)
+
+
+def startTask(url):
+    """Processes the first batch of each query registered at a URL."""
+    for kind in sorted(_TASKS[url]):
+        runBatch(url, kind)
+
+
+def runBatch(url, kind, websafeCursor=None):
+    """Processes the next batch of results of a registered query, then
+    queues the task request that processes the following one.
+
+    Args:
+        url (string): URL the task is registered at.
+        kind (string): Kind of the query.
+        websafeCursor (string): Websafe cursor where the batch starts, or
+            None for the first batch.
+    """
+    query, processBatch = _TASKS[url][kind]
+    cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+    entities, nextCursor, more = query.fetch_page(BATCH_SIZE,
+                                                  start_cursor=cursor)
+    processBatch(entities)
+    if more and nextCursor:
+        taskqueue.add(params={'kind': kind, 'cursor': nextCursor.urlsafe()},
+            url=url
+        )
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py -- Conference Central benchmark harness for the hot API
+    methods, run against the App Engine testbed stubs
+
+Seeds a synthetic data set into the local datastore stub, drives each
+benchmarked ConferenceApi method directly and reports its throughput, wall
+time percentiles and RPC counts, as recorded by the instrumentation module.
+Results are saved as JSON; pass a previous results file as --baseline to
+compare two runs.
+
+Usage:
+    python benchmark.py --sdk ~/google-cloud-sdk/platform/google_appengine
+    python benchmark.py --conferences 500 --iterations 200 \\
+        --output after.json --baseline before.json
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date
+from datetime import time as dtime
+from datetime import timedelta
+
+
+APP_ID = 'conference-central-bench'
+USER_DOMAIN = 'bench.example.com'
+TOPICS = ('Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition')
+CITIES = ('Chicago', 'London', 'Paris', 'San Francisco', 'Tokyo')
+SESSION_TYPES = ('DEMONSTRATION', 'LECTURE', 'ROUNDTABLE', 'WORKSHOP')
+
+
+def _parseArgs():
+    """Returns the parsed command line options."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+                        help='Path of the App Engine SDK (google_appengine).')
+    parser.add_argument('--conferences', type=int, default=200)
+    parser.add_argument('--sessions-per-conference', type=int, default=10)
+    parser.add_argument('--speakers', type=int, default=100)
+    parser.add_argument('--profiles', type=int, default=200)
+    parser.add_argument('--wishlist-size', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=100,
+                        help='Calls per benchmarked method.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed, so that runs are reproducible.')
+    parser.add_argument('--cold-cache', action='store_true',
+                        help='Flush memcache before every call.')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline',
+                        help='Results file of a previous run to compare to.')
+    return parser.parse_args()
+
+
+def _setUpSdk(sdk):
+    """Puts the App Engine SDK and its bundled libraries on sys.path."""
+    if sdk:
+        sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+def _activateTestbed():
+    """Activates the testbed with the stubs the API methods use."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id=APP_ID, overwrite=True)
+    # Fully consistent, so that every run sees the same query results
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=os.path.dirname(os.path.abspath(
+        __file__)))
+    bed.init_app_identity_stub()
+    bed.init_mail_stub()
+    bed.init_user_stub()
+    return bed
+
+
+def _setUser(email):
+    """Makes endpoints.get_current_user() return the given user."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = USER_DOMAIN
+
+
+def _userEmail(i):
+    """Returns the email of the i-th synthetic user."""
+    return 'user%d@%s' % (i, USER_DOMAIN)
+
+
+def _seed(args, rand):
+    """Seeds the synthetic data set.
+
+    Returns:
+        Dict with the keys of the seeded conferences, sessions and profiles.
+    """
+    from google.appengine.ext import ndb
+
+    from conference import _newSeatShards
+    from models import Conference
+    from models import Profile
+    from models import Session
+    from models import Speaker
+
+    profiles = [
+        Profile(key=ndb.Key(Profile, _userEmail(i)),
+                displayName='User %d' % i,
+                mainEmail=_userEmail(i),
+                teeShirtSize='NOT_SPECIFIED')
+            for i in range(max(args.profiles, 1))
+    ]
+    speakers = [
+        Speaker(name='Speaker %d' % i, company='Company %d' % (i % 10))
+            for i in range(max(args.speakers, 1))
+    ]
+    speakerKeys = ndb.put_multi(speakers)
+
+    conferences = []
+    shards = []
+    firstDay = date(2016, 1, 1)
+    for i in range(args.conferences):
+        organizer = rand.choice(profiles)
+        startDate = firstDay + timedelta(days=rand.randint(0, 364))
+        # Leave room for every registration the benchmark makes
+        maxAttendees = rand.randint(10, 500) + args.iterations
+        conf = Conference(
+            parent=organizer.key,
+            id=i + 1,
+            name='Conference %d' % i,
+            description='Synthetic conference %d' % i,
+            organizerUserId=organizer.mainEmail,
+            organizerDisplayName=organizer.displayName,
+            topics=rand.sample(TOPICS, rand.randint(1, 3)),
+            city=rand.choice(CITIES),
+            startDate=startDate,
+            month=startDate.month,
+            endDate=startDate + timedelta(days=rand.randint(0, 4)),
+            maxAttendees=maxAttendees,
+            seatsAvailable=maxAttendees,
+        )
+        conferences.append(conf)
+        shards.extend(_newSeatShards(conf.key, maxAttendees))
+    confKeys = ndb.put_multi(conferences)
+    ndb.put_multi(shards)
+
+    sessions = []
+    for conf in conferences:
+        for j in range(args.sessions_per_conference):
+            sessions.append(Session(
+                name='Session %d of %s' % (j, conf.name),
+                highlights=rand.sample(TOPICS, 2),
+                duration=rand.choice((30, 45, 60, 90)),
+                typeOfSession=rand.choice(SESSION_TYPES),
+                date=conf.startDate,
+                startTime=dtime(rand.randint(8, 18), rand.choice((0, 30))),
+                speaker=rand.choice(speakerKeys),
+                conference=conf.key,
+            ))
+    sessionKeys = ndb.put_multi(sessions)
+
+    for profile in profiles:
+        profile.sessionWishlist = rand.sample(
+            sessionKeys, min(args.wishlist_size, len(sessionKeys)))
+    profileKeys = ndb.put_multi(profiles)
+    return {
+        'conferences': confKeys,
+        'sessions': sessionKeys,
+        'profiles': profileKeys,
+    }
+
+
+def _benchmarks(args, rand, data):
+    """Returns (method name, label, request factory) tuples to benchmark.
+
+    Each request factory is called with the iteration number, sets the
+    current user and returns the request message for that iteration.
+    """
+    from models import CONF_GET_REQUEST
+    from models import CONF_SESSIONS_GET_REQUEST
+    from models import ConferenceQueryForm
+    from models import ConferenceQueryForms
+    from models import ListView
+    from models import WISHLIST_GET_REQUEST
+
+    confKeys = data['conferences']
+    profileKeys = data['profiles']
+
+    def anyUser(i):
+        _setUser(_userEmail(rand.randrange(len(profileKeys))))
+
+    def queryAll(i):
+        anyUser(i)
+        return ConferenceQueryForms(view=ListView.SUMMARY)
+
+    def queryFiltered(i):
+        anyUser(i)
+        return ConferenceQueryForms(filters=[
+            ConferenceQueryForm(field='CITY', operator='EQ',
+                                value=rand.choice(CITIES)),
+            ConferenceQueryForm(field='MAX_ATTENDEES', operator='GT',
+                                value=str(rand.randint(10, 500))),
+        ])
+
+    def register(i):
+        # Every (user, conference) pair registers at most once
+        _setUser(_userEmail(i % len(profileKeys)))
+        confKey = confKeys[(i // len(profileKeys)) % len(confKeys)]
+        return CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=confKey.urlsafe())
+
+    def sessions(i):
+        anyUser(i)
+        return CONF_SESSIONS_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=rand.choice(confKeys).urlsafe())
+
+    def wishlist(i):
+        anyUser(i)
+        return WISHLIST_GET_REQUEST.combined_message_class()
+
+    return [
+        ('queryConferences', 'queryConferences (summary)', queryAll),
+        ('queryConferences', 'queryConferences (filtered)', queryFiltered),
+        ('registerForConference', 'registerForConference', register),
+        ('getConferenceSessions', 'getConferenceSessions', sessions),
+        ('getSessionsInWishlist', 'getSessionsInWishlist', wishlist),
+    ]
+
+
+def _run(args, rand, data):
+    """Runs every benchmark and returns its results keyed by label."""
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+
+    import instrumentation
+    from conference import ConferenceApi
+
+    api = ConferenceApi()
+    results = {}
+    for methodName, label, makeRequest in _benchmarks(args, rand, data):
+        method = getattr(api, methodName)
+        instrumentation.resetStats()
+        elapsed = 0.0
+        for i in range(args.iterations):
+            request = makeRequest(i)
+            # Each call starts like a new request: no in-context cache
+            ndb.get_context().clear_cache()
+            if args.cold_cache:
+                memcache.flush_all()
+            start = time.time()
+            method(request)
+            elapsed += time.time() - start
+        stats = instrumentation.getStats()[methodName]
+        stats['throughput'] = args.iterations / elapsed if elapsed else None
+        results[label] = stats
+    return results
+
+
+def _compare(results, baseline):
+    """Prints the p50 wall time and RPC changes against a previous run."""
+    print('\nChange from baseline (p50):')
+    for label in sorted(results):
+        if label not in baseline:
+            continue
+        new, old = results[label], baseline[label]
+        changes = []
+        for counter in ('wallTimeMs', 'datastoreGets', 'datastoreQueries',
+                        'entitiesRead', 'memcacheGets'):
+            before, after = old[counter]['p50'], new[counter]['p50']
+            if before == after:
+                continue
+            if before:
+                changes.append('%s %+.0f%%' % (
+                    counter, 100.0 * (after - before) / before))
+            else:
+                changes.append('%s %s -> %s' % (counter, before, after))
+        print('  %-30s %s' % (label, ', '.join(changes) or 'unchanged'))
+
+
+def _report(results):
+    """Prints a summary table of the results."""
+    print('%-30s %10s %9s %9s %9s %6s %6s %8s' % (
+        'method', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms',
+        'gets', 'qrys', 'entities'))
+    for label in sorted(results):
+        stats = results[label]
+        wall = stats['wallTimeMs']
+        print('%-30s %10.1f %9.2f %9.2f %9.2f %6d %6d %8d' % (
+            label, stats['throughput'] or 0, wall['p50'], wall['p90'],
+            wall['p99'], stats['datastoreGets']['p50'],
+            stats['datastoreQueries']['p50'], stats['entitiesRead']['p50']))
+
+
+def main():
+    args = _parseArgs()
+    _setUpSdk(args.sdk)
+    # The stubs must be in place before the API modules are imported, so
+    # that the instrumentation hook is installed on the testbed's proxy
+    bed = _activateTestbed()
+    try:
+        rand = random.Random(args.seed)
+        data = _seed(args, rand)
+        results = _run(args, rand, data)
+    finally:
+        bed.deactivate()
+
+    _report(results)
+    output = {
+        'config': dict((name, value) for name, value in vars(args).items()
+                       if name not in ('sdk', 'output', 'baseline')),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print('\nResults saved to %s' % args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            _compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+cache.py -- Conference Central memcache helper with soft expiry, leases
+    and stale-while-revalidate
+
+Values are cached along with a soft expiry time instead of a memcache
+expiry, so an expired value stays available while it is being recomputed.
+A lease (a memcache add on a companion key) makes sure only one request
+recomputes a missing or expired value; the others serve the stale value,
+read the durable copy through a fallback, or wait briefly for the lease
+holder to finish.
+
+"""
+
+import logging
+import time
+
+from google.appengine.api import memcache
+
+
+DEFAULT_SOFT_TTL = 600
+LEASE_SUFFIX = ':lease'
+LEASE_TIME = 10
+LEASE_POLLS = 5
+LEASE_POLL_INTERVAL = 0.05
+
+
+def _acquireLease(key):
+    """Returns whether this request may recompute the value of the key."""
+    return memcache.add(key + LEASE_SUFFIX, 1, time=LEASE_TIME)
+
+
+def _refresh(key, compute, softTtl):
+    """Recomputes and caches the value of a key, releasing its lease."""
+    try:
+        value = compute()
+        setCachedValue(key, value, softTtl)
+        return value
+    finally:
+        memcache.delete(key + LEASE_SUFFIX)
+
+
+def _getEntry(key):
+    """Returns the (value, softExpiry) entry of a key, or None."""
+    entry = memcache.get(key)
+    # Entries cached without a soft expiry are treated as missing
+    if isinstance(entry, tuple) and len(entry) == 2:
+        return entry
+    return None
+
+
+def setCachedValue(key, value, softTtl=DEFAULT_SOFT_TTL):
+    """Caches a value, to be recomputed after softTtl seconds.
+
+    Args:
+        key (string): Memcache key.
+        value: Picklable value to cache.
+        softTtl (int): Seconds after which the value is stale. Stale values
+            are still served while one request recomputes them.
+    """
+    memcache.set(key, (value, time.time() + softTtl))
+
+
+def getCachedValue(key, compute, fallback=None, softTtl=DEFAULT_SOFT_TTL):
+    """Returns the cached value of a key, recomputing it if it is missing
+    or stale.
+
+    Args:
+        key (string): Memcache key.
+        compute (callable): Returns the up-to-date value. Only called by
+            the request holding the key's lease, except as a last resort.
+        fallback (callable): Returns the value from durable storage. Used
+            when the value is missing and another request is recomputing
+            it. If None, such requests wait for the value to be cached.
+        softTtl (int): Seconds after which a recomputed value is stale.
+
+    Returns:
+        The fresh value if cached; the stale value if it is being
+        recomputed or recomputing it fails; otherwise the recomputed value,
+        or the fallback value if another request is recomputing it or
+        computing it fails.
+    """
+    entry = _getEntry(key)
+    if entry is not None:
+        value, softExpiry = entry
+        # Serve fresh values, and stale ones while another request
+        # refreshes them
+        if softExpiry > time.time() or not _acquireLease(key):
+            return value
+        try:
+            return _refresh(key, compute, softTtl)
+        except Exception:
+            logging.exception('Failed to refresh %s, serving stale value', key)
+            return value
+    # The value is missing, e.g. evicted
+    if _acquireLease(key):
+        try:
+            return _refresh(key, compute, softTtl)
+        except Exception:
+            if not fallback:
+                raise
+            logging.exception('Failed to compute %s, serving fallback', key)
+            return fallback()
+    if fallback:
+        return fallback()
+    for _ in range(LEASE_POLLS):
+        time.sleep(LEASE_POLL_INTERVAL)
+        entry = _getEntry(key)
+        if entry is not None:
+            return entry[0]
+    # The lease holder is taking too long, so don't keep the caller waiting
+    return compute()
@@ -14,55 +14,132 @@ Modified by Richard Gieg on 2015/12/20 for Udacity Full Stack Project #4
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import csv
+import heapq
+import itertools
+import logging
+import operator
+import random
+import time
+from cStringIO import StringIO
 from datetime import datetime
+from datetime import time as dtime
 
 import endpoints
 from google.appengine.api import memcache
+from google.appengine.api import search
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protobuf
 from protorpc import remote
 
+import batchtask
+import cache
+import sessionimport
+import termindex
+import textsearch
+from converters import copyFromForm
+from converters import copyToForm
+from helpers import invalidateAgenda
+from helpers import MEMCACHE_AGENDA_PREFIX
+from helpers import MEMCACHE_LOCK_TIME
+from helpers import raiseIfWebsafeKeyNotValid
+from helpers import scheduleFeaturedSpeakerUpdate
+from helpers import speakerStatsKey
+from instrumentation import instrumented
+from models import AgendaDayForm
+from models import AgendaForm
+from models import AgendaSessionForm
+from models import Announcement
+from models import ATTENDEE_EXPORT_GET_REQUEST
+from models import AttendeeExport
+from models import AttendeeExportChunk
+from models import AttendeeExportForm
+from models import AttendeeForm
+from models import AttendeeForms
 from models import BooleanMessage
+from models import CONF_ATTENDEES_GET_REQUEST
 from models import CONF_DEFAULTS
 from models import CONF_GET_REQUEST
+from models import CONF_GROUP_POST_REQUEST
 from models import CONF_POST_REQUEST
+from models import CONF_SESSIONS_GET_REQUEST
 from models import CONF_TOPICS_GET_REQUEST
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceSeatShard
+from models import CONF_SUMMARY_FIELDS
 from models import ConflictException
+from models import FeaturedSpeaker
+from models import ListView
+from models import MINUTES_PER_DAY
+from models import MatchMode
+from models import NearlySoldOutConference
+from models import PAGED_GET_REQUEST
+from models import PLACEHOLDER_SESSION_START_TIME
+from models import SEARCH_GET_REQUEST
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import Registration
+from models import RegistrationResultForm
+from models import RegistrationResultForms
 from models import Session
 from models import SESSION_DEFAULTS
 from models import SESSION_DOUBLE_INEQUALITY_GET_REQUEST
 from models import SESSION_GET_REQUEST
 from models import SESSION_HIGHLIGHTS_GET_REQUEST
+from models import SESSION_IMPORT_GET_REQUEST
+from models import SESSION_IMPORT_POST_REQUEST
 from models import SESSION_POST_REQUEST
+from models import SESSION_QUERY_GET_REQUEST
 from models import SESSION_SPEAKER_GET_REQUEST
+from models import SESSION_SUMMARY_FIELDS
+from models import SESSION_WISHLIST_POST_REQUEST
 from models import SESSIONTYPE_GET_REQUEST
+from models import SessionConflictForm
+from models import SessionConflictForms
 from models import SessionForm
 from models import SessionForms
+from models import SessionImportStatusForm
 from models import SessionType
 from models import Speaker
+from models import SpeakerConferenceStats
 from models import SPEAKER_DEFAULTS
 from models import SPEAKER_GET_REQUEST
 from models import SpeakerForm
 from models import SpeakerForms
 from models import StringMessage
 from models import TeeShirtSize
+from models import toTimeSlot
+from models import WISHLIST_CONFLICTS_GET_REQUEST
+from models import WISHLIST_GET_REQUEST
+from models import WishlistForm
 from settings import WEB_CLIENT_ID
 
 
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+ANNOUNCEMENT_ID = "nearly_sold_out"
+NEARLY_SOLD_OUT_SEATS = 5
+MEMCACHE_FEATURED_SPEAKER_PREFIX = "FEATURED_SPEAKER:"
+ANNOUNCEMENT_SOFT_TTL = 600
+FEATURED_SPEAKER_SOFT_TTL = 3600
+MEMCACHE_FORM_TIME = 600
+SEAT_SHARD_COUNT = 10
+SEAT_SYNC_DELAY = 10
+MAX_GROUP_REGISTRATION = 100
+MAX_WISHLIST_UPDATE = 100
+TASK_BATCH_SIZE = 100
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 OPERATORS = {
     'EQ': '=',
@@ -80,41 +157,19 @@ FIELDS = {
     'MAX_ATTENDEES': 'maxAttendees',
 }
 
+MEMORY_OPERATORS = {
+    '=': operator.eq,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
 
-def _raiseIfWebsafeKeyNotValid(websafeKey, kind):
-    """Ensures that a websafe key is valid and of the desired kind.
-
-    Args:
-        websafeKey (string): Websafe key that is to be verified.
-        kind (string): Used to ensure that the websafe key represents the
-            desired kind. For example, "Session".
-
-    Returns:
-        If websafeKey is not None, is valid and is of the desired kind, then
-        the function returns the actual key. Otherwise, an exception is raised.
+MAX_SCAN_SIZE = 1000
 
-    Raises:
-        endpoints.BadRequestException: Occurs if the websafeKey argument
-            is either equal to None, not able to be decoded or not of the
-            desired kind.
-    """
-    # Check that websafeKey is not None
-    if not websafeKey:
-        raise endpoints.BadRequestException(
-            "Websafe key not provided for '%s'" % kind)
-    # Try to decode the websafe key into a real key
-    try:
-        key = ndb.Key(urlsafe=websafeKey)
-    except:
-        raise endpoints.BadRequestException(
-            "Websafe key provided for '%s' could not be decoded: %s" %
-                (kind, websafeKey))
-    # Ensure that the key is of the desired kind
-    if key.kind() != kind:
-        raise endpoints.BadRequestException(
-            "Websafe key is not of the '%s' kind: %s" % (kind, websafeKey))
-    # If all is well, return the key
-    return key
+EXPORT_BATCH_SIZE = 500
+EXPORT_CSV_FIELDS = ('mainEmail', 'displayName', 'teeShirtSize')
 
 
 def _getEntityByWebsafeKey(websafeKey, kind):
@@ -138,7 +193,7 @@ def _getEntityByWebsafeKey(websafeKey, kind):
             tests but the entity is not located.
     """
     # Ensure that the websafe key is valid
-    key = _raiseIfWebsafeKeyNotValid(websafeKey, kind)
+    key = raiseIfWebsafeKeyNotValid(websafeKey, kind)
     # Get the entity
     entity = key.get()
     if not entity:
@@ -149,6 +204,689 @@ def _getEntityByWebsafeKey(websafeKey, kind):
     return entity
 
 
+def _fetchPage(query, request, **options):
+    """Fetches one page of query results using a cursor.
+
+    Args:
+        query (ndb.Query): Query that is to be executed. Queries that use
+            OR, IN or != filters must be ordered by key last in order to
+            support cursors.
+        request: Request message containing the optional pageSize and
+            pageToken fields.
+        **options: Additional query options passed on to fetch_page.
+
+    Returns:
+        A tuple containing the list of results and the websafe token that
+        can be used to fetch the next page. The token is None if there are
+        no more results.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the pageSize is out of
+            range or the pageToken could not be decoded.
+    """
+    pageSize, cursor = _getPageOptions(request)
+    # Fetch the page, only returning a token if there are more results
+    results, nextCursor, more = query.fetch_page(
+        pageSize, start_cursor=cursor, **options)
+    nextPageToken = None
+    if more and nextCursor:
+        nextPageToken = nextCursor.urlsafe()
+    return (results, nextPageToken)
+
+
+@ndb.tasklet
+def _fetchMatchingPageAsync(query, request, matches):
+    """Fetches one page of query results that also satisfy a condition
+    checked in memory.
+
+    The query is run keys-only and its results are streamed in batches.
+    The entities of each batch are fetched with one get_multi and checked,
+    until the page is full or MAX_SCAN_SIZE keys were scanned. In the latter
+    case the page may be short, but a next page token is still returned.
+
+    Args:
+        query (ndb.Query): Query that is to be executed.
+        request: Request message containing the optional pageSize and
+            pageToken fields.
+        matches (callable): Returns whether an entity belongs in the results.
+
+    Returns:
+        A tuple containing the list of matching entities and the token of
+        the next page, which is None if there are no more results.
+    """
+    pageSize, cursor = _getPageOptions(request)
+    it = query.iter(keys_only=True, batch_size=pageSize,
+                    start_cursor=cursor, produce_cursors=True)
+    results = []
+    nextCursor = None
+    scanned = 0
+    exhausted = False
+    while (not exhausted and len(results) < pageSize and
+            scanned < MAX_SCAN_SIZE):
+        # Collect the next batch of keys, along with the cursor that points
+        # after each of them
+        keys = []
+        cursors = []
+        while len(keys) < pageSize:
+            if not (yield it.has_next_async()):
+                exhausted = True
+                break
+            keys.append(it.next())
+            cursors.append(it.cursor_after())
+        scanned += len(keys)
+        entities = yield ndb.get_multi_async(keys)
+        for i, entity in enumerate(entities):
+            nextCursor = cursors[i]
+            if entity and matches(entity):
+                results.append(entity)
+                if len(results) == pageSize:
+                    # Keys remaining in this batch go on the next page
+                    exhausted = exhausted and i == len(entities) - 1
+                    break
+    # Only return a token if there may be more results
+    nextPageToken = None
+    if nextCursor and not exhausted:
+        nextPageToken = nextCursor.urlsafe()
+    raise ndb.Return((results, nextPageToken))
+
+
+def _getPageSize(request):
+    """Returns the page size of a request, defaulting to DEFAULT_PAGE_SIZE.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the pageSize is out of
+            range.
+    """
+    pageSize = request.pageSize or DEFAULT_PAGE_SIZE
+    if pageSize < 1 or pageSize > MAX_PAGE_SIZE:
+        raise endpoints.BadRequestException(
+            "'pageSize' must be between 1 and %d" % MAX_PAGE_SIZE)
+    return pageSize
+
+
+def _getPageOptions(request):
+    """Validates the paging fields of a request.
+
+    Returns:
+        A tuple containing the page size and the cursor decoded from the
+        page token (None when no token was given).
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the pageSize is out of
+            range or the pageToken could not be decoded.
+    """
+    pageSize = _getPageSize(request)
+    # Decode the page token into a cursor, if provided
+    cursor = None
+    if request.pageToken:
+        try:
+            cursor = Cursor(urlsafe=request.pageToken)
+        except:
+            raise endpoints.BadRequestException(
+                "Invalid 'pageToken' value")
+    return (pageSize, cursor)
+
+
+def _pageOfList(items, request):
+    """Slices one page out of a list of results computed in memory.
+
+    Args:
+        items (list): All results, in a stable order.
+        request: Request message containing the optional pageSize and
+            pageToken fields. The page token is the offset of the page.
+
+    Returns:
+        A tuple containing the results of the page and the token of the
+        next page, which is None if there are no more results.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the pageSize is out of
+            range or the pageToken is not a valid offset.
+    """
+    pageSize = _getPageSize(request)
+    offset = 0
+    if request.pageToken:
+        if not request.pageToken.isdigit():
+            raise endpoints.BadRequestException(
+                "Invalid 'pageToken' value")
+        offset = int(request.pageToken)
+    end = offset + pageSize
+    nextPageToken = str(end) if end < len(items) else None
+    return (items[offset:end], nextPageToken)
+
+
+def _searchPage(kind, request):
+    """Runs one page of a full-text search over the entities of a kind.
+
+    Args:
+        kind (string): "Conference", "Session" or "Speaker".
+        request: Request message containing the query and the optional
+            pageSize and pageToken fields.
+
+    Returns:
+        A tuple containing the keys of the matching entities, best match
+        first, and the token of the next page (None if there are no more
+        results).
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the query can't be parsed,
+            the pageSize is out of range or the pageToken is not valid.
+    """
+    if not request.query:
+        raise endpoints.BadRequestException("'query' field required")
+    pageSize = _getPageSize(request)
+    try:
+        return textsearch.searchKeys(kind, request.query, pageSize,
+                                     request.pageToken)
+    except search.QueryError:
+        raise endpoints.BadRequestException(
+            "Invalid 'query' value: %s" % request.query)
+    except ValueError:
+        raise endpoints.BadRequestException("Invalid 'pageToken' value")
+
+
+def _termSearchPage(kind, terms, request):
+    """Looks up one page of the entities of a kind that carry the given
+    topics or highlights in the inverted index.
+
+    Returns:
+        A tuple containing the keys of the matching entities, ranked by the
+        number of matching terms, and the token of the next page (None if
+        there are no more results).
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the pageSize is out of
+            range or the pageToken is not valid.
+    """
+    pageSize = _getPageSize(request)
+    try:
+        return termindex.searchKeys(kind, terms, pageSize,
+                                    request.pageToken,
+                                    request.match == MatchMode.ALL)
+    except ValueError:
+        raise endpoints.BadRequestException("Invalid 'pageToken' value")
+
+
+def _getCachedForms(formClass, keys, render):
+    """Retrieves rendered forms for the given keys, reading through memcache.
+
+    Args:
+        formClass: ProtoRPC message class of the rendered forms. Its name is
+            used as the memcache key prefix.
+        keys (list): Keys of the entities whose forms are requested.
+        render (callable): Called with the list of entities that were not
+            found in memcache. Must return their forms in the same order.
+
+    Returns:
+        List of forms in the same order as the keys argument. Keys that do
+        not reference an existing entity are skipped.
+    """
+    prefix = formClass.__name__ + ':'
+    websafeKeys = [key.urlsafe() for key in keys]
+    cached = memcache.get_multi(websafeKeys, key_prefix=prefix)
+    forms = {}
+    for websafeKey, payload in cached.items():
+        forms[websafeKey] = protobuf.decode_message(formClass, payload)
+    # Load and render the entities that weren't cached, then cache them
+    missingKeys = [key for key, websafeKey in zip(keys, websafeKeys)
+                   if websafeKey not in forms]
+    if missingKeys:
+        entities = [e for e in ndb.get_multi(missingKeys) if e]
+        rendered = {}
+        for entity, form in zip(entities, render(entities)):
+            rendered[entity.key.urlsafe()] = form
+        # Add rather than set, which fails while a form is locked after a
+        # change, so that forms rendered from entities loaded before the
+        # change aren't cached
+        memcache.add_multi(
+            {wsk: protobuf.encode_message(f) for wsk, f in rendered.items()},
+            key_prefix=prefix, time=MEMCACHE_FORM_TIME)
+        forms.update(rendered)
+    return [forms[wsk] for wsk in websafeKeys if wsk in forms]
+
+
+def _invalidateCachedForms(formClass, keys):
+    """Removes rendered forms from memcache once the transaction commits.
+
+    The forms can't be cached again for MEMCACHE_LOCK_TIME seconds, so that
+    a concurrent read that loaded an entity before the commit can't put its
+    stale form back.
+
+    Args:
+        formClass: ProtoRPC message class of the rendered forms.
+        keys (list): Keys of the entities whose forms are stale.
+    """
+    prefix = formClass.__name__ + ':'
+    websafeKeys = [key.urlsafe() for key in keys]
+    # Outside of a transaction the callback is run immediately
+    ndb.get_context().call_on_commit(
+        lambda: memcache.delete_multi(websafeKeys, seconds=MEMCACHE_LOCK_TIME,
+                                      key_prefix=prefix))
+
+
+def _seatShardKeys(confKey):
+    """Returns the keys of all seat shards belonging to a conference."""
+    return [
+        ndb.Key(ConferenceSeatShard, '%s-%d' % (confKey.urlsafe(), i))
+            for i in range(SEAT_SHARD_COUNT)
+    ]
+
+
+def _splitSeats(seats):
+    """Splits a number of seats as evenly as possible across the shards."""
+    return [
+        seats // SEAT_SHARD_COUNT + (1 if i < seats % SEAT_SHARD_COUNT else 0)
+            for i in range(SEAT_SHARD_COUNT)
+    ]
+
+
+def _newSeatShards(confKey, seatsAvailable, reserved=0):
+    """Returns new (unsaved) seat shards for a conference.
+
+    Args:
+        confKey (ndb.Key): Key of the conference that owns the shards.
+        seatsAvailable (int): Number of seats that are still free. They are
+            split evenly across the shards.
+        reserved (int): Number of seats that are already taken. They are
+            assigned to the first shard.
+    """
+    shards = [
+        ConferenceSeatShard(key=key, conference=confKey, capacity=capacity)
+            for key, capacity in zip(_seatShardKeys(confKey),
+                                     _splitSeats(seatsAvailable))
+    ]
+    shards[0].capacity += reserved
+    shards[0].reserved = reserved
+    return shards
+
+
+@ndb.transactional(xg=True)
+def _createSeatShards(confKey):
+    """Creates the seat shards for a conference that doesn't have them yet,
+    seeding them from the conference's seatsAvailable and maxAttendees.
+    """
+    shards = ndb.get_multi(_seatShardKeys(confKey))
+    # Another request may have created the shards in the meantime
+    if None not in shards:
+        return shards
+    conf = confKey.get()
+    seatsAvailable = max(conf.seatsAvailable or 0, 0)
+    reserved = max((conf.maxAttendees or 0) - seatsAvailable, 0)
+    shards = _newSeatShards(confKey, seatsAvailable, reserved)
+    ndb.put_multi(shards)
+    return shards
+
+
+def _getSeatShards(confKey):
+    """Returns the seat shards for a conference, creating them if needed."""
+    shards = ndb.get_multi(_seatShardKeys(confKey))
+    if None in shards:
+        shards = _createSeatShards(confKey)
+    return shards
+
+
+@ndb.transactional(xg=True)
+def _reserveSeats(confKey, count):
+    """Reserves up to the given number of seats across the seat shards of a
+    conference in a single transaction.
+
+    Returns:
+        The number of seats that were actually reserved, which is lower than
+        the count argument when the conference doesn't have enough seats.
+    """
+    shards = ndb.get_multi(_seatShardKeys(confKey))
+    random.shuffle(shards)
+    changed = []
+    reserved = 0
+    for shard in shards:
+        if reserved == count:
+            break
+        taken = min(shard.capacity - shard.reserved, count - reserved)
+        if taken > 0:
+            shard.reserved += taken
+            reserved += taken
+            changed.append(shard)
+    ndb.put_multi(changed)
+    return reserved
+
+
+@ndb.transactional(xg=True)
+def _releaseSeats(confKey, count):
+    """Gives back the given number of seats to the seat shards of a
+    conference in a single transaction.
+    """
+    shards = ndb.get_multi(_seatShardKeys(confKey))
+    changed = []
+    for shard in shards:
+        if count <= 0:
+            break
+        released = min(shard.reserved, count)
+        if released > 0:
+            shard.reserved -= released
+            count -= released
+            changed.append(shard)
+    ndb.put_multi(changed)
+
+
+@ndb.transactional(xg=True)
+def _releaseLeakedSeats(confKey, registered):
+    """Gives back the seats that the seat shards of a conference reserve
+    beyond the given number of registrations, in a single transaction.
+
+    Returns:
+        The number of seats given back.
+    """
+    shards = ndb.get_multi(_seatShardKeys(confKey))
+    if None in shards:
+        return 0
+    leaked = sum(shard.reserved for shard in shards) - registered
+    count = leaked
+    changed = []
+    for shard in shards:
+        if count <= 0:
+            break
+        released = min(shard.reserved, count)
+        if released > 0:
+            shard.reserved -= released
+            count -= released
+            changed.append(shard)
+    ndb.put_multi(changed)
+    return max(leaked, 0)
+
+
+def _countSeatsAvailable(shards):
+    """Returns the total number of free seats across the given shards."""
+    return sum(shard.capacity - shard.reserved for shard in shards)
+
+
+def _scheduleSeatSync(confKey):
+    """Schedules a task that copies the total of the seat shards into the
+    conference's seatsAvailable property.
+
+    Tasks are named after the conference and the current time window, so
+    all registrations within SEAT_SYNC_DELAY seconds result in a single
+    write to the conference entity.
+    """
+    websafeConferenceKey = confKey.urlsafe()
+    window = int(time.time()) // SEAT_SYNC_DELAY
+    try:
+        taskqueue.add(
+            name='seats-%s-%d' % (websafeConferenceKey, window),
+            params={'websafeConferenceKey': websafeConferenceKey},
+            url='/tasks/sync_seats_available',
+            countdown=SEAT_SYNC_DELAY
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        # A sync is already scheduled for this time window
+        pass
+
+
+def _isNearlySoldOut(seatsAvailable):
+    """Returns whether a conference with the given number of free seats is
+    listed in the announcement.
+    """
+    return 0 < (seatsAvailable or 0) <= NEARLY_SOLD_OUT_SEATS
+
+
+def _formatAnnouncement(entries):
+    """Returns the announcement message for the nearly sold out conferences,
+    or an empty string if there are none.
+    """
+    if not entries:
+        return ""
+    return '%s %s' % (
+        'Last chance to attend! The following conferences '
+        'are nearly sold out:',
+        ', '.join(sorted(entry.name for entry in entries)))
+
+
+def _storeAnnouncement(announcement, entries):
+    """Stores the nearly sold out conferences, refreshing the memcache
+    entry in front of them once the transaction (if any) commits.
+    """
+    announcement.conferences = entries
+    announcement.put()
+    message = _formatAnnouncement(entries)
+    ndb.get_context().call_on_commit(
+        lambda: cache.setCachedValue(MEMCACHE_ANNOUNCEMENTS_KEY, message,
+                                     ANNOUNCEMENT_SOFT_TTL))
+    return message
+
+
+def _getStoredAnnouncement():
+    """Returns the announcement message from the datastore."""
+    stored = ndb.Key(Announcement, ANNOUNCEMENT_ID).get()
+    return _formatAnnouncement(stored.conferences if stored else [])
+
+
+def _getStoredFeaturedSpeaker(websafeConferenceKey):
+    """Returns the featured speaker message of a conference from the
+    datastore, or an empty string if it has none.
+    """
+    featured = ndb.Key(FeaturedSpeaker, websafeConferenceKey).get()
+    return featured.message if featured else ""
+
+
+def _updateAnnouncement(conf):
+    """Adds a conference to or removes it from the announcement, depending
+    on its seatsAvailable. Called in the (cross-group) transaction that
+    writes the conference, when the conference crosses the seat threshold
+    or a listed conference changes.
+    """
+    announcementKey = ndb.Key(Announcement, ANNOUNCEMENT_ID)
+    announcement = announcementKey.get() or Announcement(key=announcementKey)
+    entries = [entry for entry in announcement.conferences
+               if entry.conference != conf.key]
+    if _isNearlySoldOut(conf.seatsAvailable):
+        entries.append(
+            NearlySoldOutConference(conference=conf.key, name=conf.name))
+    if entries != announcement.conferences:
+        _storeAnnouncement(announcement, entries)
+
+
+def _countSpeakerSessions(speakerKey, sessions):
+    """Returns new (unsaved) session counters of a speaker, computed from
+    the given sessions, which must be all of the speaker's sessions.
+    """
+    statsByConf = {}
+    for session in sessions:
+        stats = statsByConf.get(session.conference)
+        if not stats:
+            stats = statsByConf[session.conference] = SpeakerConferenceStats(
+                key=speakerStatsKey(speakerKey, session.conference),
+                speaker=speakerKey,
+                conference=session.conference)
+        stats.sessionCount += 1
+        stats.sessionNames.append(session.name)
+    return statsByConf.values()
+
+
+@ndb.transactional_tasklet
+def _mergeSpeakerStatsAsync(counted):
+    """Stores a session counter recounted by the speaker migration, unless
+    the stored counter already counts at least as many sessions, as it does
+    once sessions created since the count have been added to it. The
+    import IDs of the stored counter are kept.
+    """
+    stats = yield counted.key.get_async()
+    if not stats:
+        yield counted.put_async()
+    elif stats.sessionCount < counted.sessionCount:
+        stats.sessionCount = counted.sessionCount
+        stats.sessionNames = counted.sessionNames
+        yield stats.put_async()
+
+
+@ndb.transactional_tasklet
+def _dropLegacySpeakerSessionsAsync(speakerKey):
+    """Empties the legacy sessions list of a speaker, which removes it from
+    the stored entity.
+    """
+    speaker = yield speakerKey.get_async()
+    if speaker and speaker.sessions:
+        speaker.sessions = []
+        yield speaker.put_async()
+
+
+def _registrationKey(profKey, websafeConferenceKey):
+    """Returns the key of a profile's registration for a conference."""
+    return ndb.Key(Registration, websafeConferenceKey, parent=profKey)
+
+
+def _takeLegacyRegistrations(prof):
+    """Moves the profile's legacy conferenceKeysToAttend list into new
+    (unsaved) Registration entities, emptying the list.
+    """
+    registrations = []
+    for wsck in prof.conferenceKeysToAttend:
+        try:
+            confKey = ndb.Key(urlsafe=wsck)
+        except:
+            logging.warning('Dropping undecodable conference key %r of %s',
+                            wsck, prof.key.id())
+            continue
+        registrations.append(Registration(
+            key=_registrationKey(prof.key, wsck), conference=confKey))
+    prof.conferenceKeysToAttend = []
+    return registrations
+
+
+def _getRegisteredConferenceKeys(prof):
+    """Returns the websafe keys of the conferences a profile is registered
+    for, including those still in its legacy list.
+    """
+    # Ancestor queries are strongly consistent, so a registration shows up
+    # as soon as it commits
+    regKeys = Registration.query(ancestor=prof.key).fetch(keys_only=True)
+    wscks = [regKey.id() for regKey in regKeys]
+    wscks.extend(wsck for wsck in prof.conferenceKeysToAttend
+                 if wsck not in wscks)
+    return wscks
+
+
+@ndb.transactional_tasklet
+def _migrateRegistrationsAsync(profKey):
+    """Converts the legacy conferenceKeysToAttend list of a profile into
+    Registration entities, which share the profile's entity group.
+    """
+    prof = yield profKey.get_async()
+    if prof and prof.conferenceKeysToAttend:
+        registrations = _takeLegacyRegistrations(prof)
+        yield ndb.put_multi_async(registrations + [prof])
+
+
+def _csvValue(value):
+    """Converts a property value to a UTF-8 encoded CSV cell."""
+    return '' if value is None else (u'%s' % value).encode('utf-8')
+
+
+def _queueAttendeeExportBatch(exportKey, websafeCursor, chunkId):
+    """Queues the task that writes the given batch of an attendee export.
+
+    Tasks are named after the export and batch, so a retried task can't
+    start a second chain of batches.
+    """
+    params = {'websafeExportKey': exportKey.urlsafe(), 'chunkId': chunkId}
+    if websafeCursor:
+        params['cursor'] = websafeCursor
+    try:
+        taskqueue.add(
+            name='attendees-%d-%d' % (exportKey.id(), chunkId),
+            params=params,
+            url='/tasks/export_attendees'
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.transactional_tasklet
+def _setOrganizerDisplayNameAsync(confKeys, displayName):
+    """Stores the organizer display name on the given conferences, which
+    must all belong to the same organizer (entity group).
+    """
+    confs = yield ndb.get_multi_async(confKeys)
+    changed = [
+        conf for conf in confs
+            if conf and conf.organizerDisplayName != displayName
+    ]
+    for conf in changed:
+        conf.organizerDisplayName = displayName
+    yield ndb.put_multi_async(changed)
+    _invalidateCachedForms(ConferenceForm, [conf.key for conf in changed])
+
+
+def _findConflicts(sessions):
+    """Finds the overlapping pairs among the given sessions with an
+    interval sweep, in O(n log n) plus the number of pairs.
+
+    The sessions are visited in order of start time. A heap holds those
+    that are still running, ordered by end time, so sessions that ended
+    before the current one starts are dropped and all remaining ones
+    overlap with it.
+
+    Args:
+        sessions (list): Sessions to check. Sessions without a time slot
+            are ignored, and so are those starting at the placeholder start
+            time, which they are given when created without one; a session
+            that really starts at midnight is therefore never reported.
+
+    Yields:
+        (earlier, later) tuples of overlapping sessions, in order of the
+        start time of the later session.
+    """
+    timed = sorted(
+        (s.timeSlot, s.duration or 0, s.key, s) for s in sessions
+            if s.timeSlot is not None and
+                s.startTime != PLACEHOLDER_SESSION_START_TIME)
+    running = []
+    for start, duration, _, session in timed:
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        for _, _, other in running:
+            yield (other, session)
+        heapq.heappush(running, (start + duration, session.key, session))
+
+
+def _parseField(request, name, dateFormat):
+    """Parses an optional date or time string field of a request.
+
+    Returns:
+        The datetime parsed from the field, or None if it is empty.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the value doesn't match
+            the format.
+    """
+    value = getattr(request, name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, dateFormat)
+    except ValueError:
+        raise endpoints.BadRequestException("Invalid '%s' value" % name)
+
+
+def _matchesFilters(entity, filters):
+    """Checks an entity against formatted filters in memory.
+
+    Args:
+        entity: NDB entity to check.
+        filters (list): Formatted filters (dicts containing the field,
+            operator and value) that must all be satisfied.
+
+    Returns:
+        True if the entity satisfies all filters. Like the datastore, a
+        filter on a repeated property is satisfied if any value matches.
+    """
+    for filtr in filters:
+        value = getattr(entity, filtr["field"])
+        values = value if isinstance(value, list) else [value]
+        compare = MEMORY_OPERATORS[filtr["operator"]]
+        if not any(compare(v, filtr["value"]) for v in values):
+            return False
+    return True
+
+
 @endpoints.api(name='conference', version='v1',
     allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID],
     scopes=[EMAIL_SCOPE])
@@ -161,83 +899,365 @@ class ConferenceApi(remote.Service):
 
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Rebuild the announcement from a scan of the conferences that are
+        nearly sold out, in case an incremental update was missed; used by
+        the reconciliation cron job.
         """
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
-        if confs:
-            # If there are conferences close to being sold out,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
-                'Last chance to attend! The following conferences '
-                'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-        return announcement
+        entries = [
+            NearlySoldOutConference(conference=conf.key, name=conf.name)
+                for conf in confs
+        ]
+
+        @ndb.transactional()
+        def txn():
+            announcementKey = ndb.Key(Announcement, ANNOUNCEMENT_ID)
+            announcement = (announcementKey.get() or
+                            Announcement(key=announcementKey))
+            return _storeAnnouncement(announcement, entries)
+        return txn()
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        # Get user profile
-        prof = self._getProfileFromUser()
         # Check if conference given in the websafeConferenceKey exists
         wsck = request.websafeConferenceKey
         conf = _getEntityByWebsafeKey(wsck, 'Conference')
+        # Order the seat shards so that the ones which can satisfy the
+        # request come first. Shuffling spreads concurrent registrations
+        # across the shards' entity groups.
+        shards = _getSeatShards(conf.key)
+        random.shuffle(shards)
+        if reg:
+            usable = lambda shard: shard.reserved < shard.capacity
+        else:
+            usable = lambda shard: shard.reserved > 0
+        shardKeys = [shard.key for shard in shards if usable(shard)]
+        shardKeys += [shard.key for shard in shards if not usable(shard)]
+        retval = self._conferenceRegistrationTxn(wsck, shardKeys, reg)
+        # Have the conference's seatsAvailable catch up with the shards
+        if retval:
+            _scheduleSeatSync(conf.key)
+        return BooleanMessage(data=retval)
+
+    @ndb.transactional(xg=True)
+    def _conferenceRegistrationTxn(self, wsck, shardKeys, reg):
+        """Update the user's registration and one seat shard of the
+        conference, returning whether anything changed.
+        """
+        # Get user profile
+        prof = self._getProfileFromUser()
+        regKey = _registrationKey(prof.key, wsck)
+        # Move registrations still in the legacy list over along the way;
+        # they are in the profile's entity group
+        entities = []
+        if prof.conferenceKeysToAttend:
+            entities = _takeLegacyRegistrations(prof) + [prof]
+        registered = (regKey in [e.key for e in entities] or
+                      regKey.get() is not None)
         # Register
         if reg:
             # Check if user already registered, otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if registered:
                 raise ConflictException(
                     "You have already registered for this conference.")
-            # Check if seats available
-            if conf.seatsAvailable <= 0:
+            # Check if seats available, stopping at the first shard that
+            # has a free seat
+            for shardKey in shardKeys:
+                shard = shardKey.get()
+                if shard.reserved < shard.capacity:
+                    break
+            else:
                 raise ConflictException(
                     "There are no seats available.")
             # Register user, deduct one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            entities.append(Registration(key=regKey,
+                                         conference=ndb.Key(urlsafe=wsck)))
+            shard.reserved += 1
+            entities.append(shard)
         # Unregister
         else:
             # Check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-                # Unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+            if not registered:
+                return False
+            # Unregister user, add back one seat to any shard holding one
+            entities = [e for e in entities if e.key != regKey]
+            regKey.delete()
+            for shardKey in shardKeys:
+                shard = shardKey.get()
+                if shard.reserved > 0:
+                    shard.reserved -= 1
+                    entities.append(shard)
+                    break
             else:
-                retval = False
+                # The shards lost track of the seat, so there is none to
+                # give back
+                logging.warning('No reserved seat to release for %s', wsck)
         # Update the datastore and return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        ndb.put_multi(entities)
+        return True
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _conferenceGroupRegistration(self, request):
+        """Register a group of users for selected conference, returning a
+        result per email address. Only the conference organizer may do so.
+        """
+        wsck = request.websafeConferenceKey
+        conf = self._getOrganizedConference(wsck, 'register groups for it')
+        # Remove duplicate email addresses, preserving order
+        emails = []
+        for email in request.emails:
+            if email and email not in emails:
+                emails.append(email)
+        if not emails:
+            raise endpoints.BadRequestException(
+                'At least one email address must be specified')
+        if len(emails) > MAX_GROUP_REGISTRATION:
+            raise endpoints.BadRequestException(
+                'At most %d email addresses may be specified' %
+                    MAX_GROUP_REGISTRATION)
+        # Check which users are already registered with one batch get, so
+        # that no seats are reserved for them
+        profKeys = [ndb.Key(Profile, email) for email in emails]
+        regKeys = [_registrationKey(profKey, wsck) for profKey in profKeys]
+        entities = ndb.get_multi(profKeys + regKeys)
+        profiles, existing = entities[:len(emails)], entities[len(emails):]
+        profiles = dict(zip(emails, profiles))
+        results = {}
+        pending = []
+        for email, registration in zip(emails, existing):
+            prof = profiles[email]
+            if registration or (prof and wsck in prof.conferenceKeysToAttend):
+                results[email] = (False,
+                    'Already registered for this conference.')
+            else:
+                pending.append(email)
+        # Reserve seats for the pending users in one pass. Users that don't
+        # get a seat are reported as such.
+        _getSeatShards(conf.key)
+        reserved = _reserveSeats(conf.key, len(pending)) if pending else 0
+        for email in pending[reserved:]:
+            results[email] = (False, 'There are no seats available.')
+        # Look the registrations up again, since users may have registered
+        # themselves in the meantime, then write all new registrations, and
+        # the profiles that don't exist yet, in one batch. A registration
+        # racing this write may still leave a seat reserved twice; the seat
+        # reconciliation job gives such seats back.
+        booked = pending[:reserved]
+        regKeys = [_registrationKey(ndb.Key(Profile, email), wsck)
+                   for email in booked]
+        writes = []
+        unused = 0
+        for email, regKey, registration in zip(booked, regKeys,
+                                               ndb.get_multi(regKeys)):
+            if registration:
+                unused += 1
+                results[email] = (False,
+                    'Already registered for this conference.')
+                continue
+            writes.append((email, Registration(key=regKey,
+                                               conference=conf.key)))
+            if not profiles[email]:
+                writes.append((email, Profile(
+                    key=regKey.parent(),
+                    displayName=email,
+                    mainEmail=email,
+                    teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
+                )))
+        futures = ndb.put_multi_async([entity for _, entity in writes])
+        ndb.Future.wait_all(futures)
+        failed = set()
+        for (email, _), future in zip(writes, futures):
+            if future.get_exception():
+                logging.error('Failed to register %s for %s: %s', email,
+                              wsck, future.get_exception())
+                failed.add(email)
+        for email, _ in writes:
+            if email in results:
+                continue
+            if email in failed:
+                unused += 1
+                results[email] = (False, 'Registration failed.')
+            else:
+                results[email] = (True, None)
+        # Give back the seats of the users that weren't registered
+        if unused:
+            _releaseSeats(conf.key, unused)
+        if unused < reserved:
+            _scheduleSeatSync(conf.key)
+        # Return a result per email address, in the order they were given
+        return RegistrationResultForms(
+            items=[
+                RegistrationResultForm(
+                    email=email,
+                    websafeConferenceKey=wsck,
+                    registered=results[email][0],
+                    message=results[email][1]
+                ) for email in emails
+            ]
+        )
+
+    @staticmethod
+    def _backfillOrganizerDisplayNames(confs):
+        """Store the organizer display name on a batch of conferences that
+        predate the organizerDisplayName property; used by the backfill task.
+        """
+        # Group the conferences without a display name by organizer, since
+        # each organizer's conferences share an entity group
+        confKeys = {}
+        for conf in confs:
+            if not conf.organizerDisplayName:
+                confKeys.setdefault(conf.key.parent(), []).append(conf.key)
+        profiles = ndb.get_multi(confKeys.keys())
+        futures = [
+            _setOrganizerDisplayNameAsync(confKeys[prof.key], prof.displayName)
+                for prof in profiles if prof
+        ]
+        ndb.Future.wait_all(futures)
+        for future in futures:
+            future.check_success()
+
+    def _copyAttendeeExportToForm(self, export):
+        """Copy relevant fields from AttendeeExport to AttendeeExportForm."""
+        form = AttendeeExportForm(
+            websafeKey=export.key.urlsafe(),
+            websafeConferenceKey=export.conference.urlsafe(),
+            status=export.status,
+            attendeeCount=export.attendeeCount
+        )
+        if export.status == 'DONE':
+            form.downloadUrl = '/exports/attendees/%s' % export.key.urlsafe()
+        return form
+
+    def _copyConferenceToForm(self, conf, displayName=None, view=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # Convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = copyToForm(conf, ConferenceForm, view)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
         return cf
 
+    def _copyConferencesToForms(self, conferences):
+        """Copy a list of Conferences to ConferenceForms, fetching the
+        organizer display names that weren't stored on the conferences in a
+        single batch.
+        """
+        organisers = {}
+        for conf in conferences:
+            if conf.organizerDisplayName:
+                continue
+            # The organizer's Profile is the parent of the conference
+            orgKey = conf.key.parent()
+            if orgKey not in organisers:
+                organisers[orgKey] = orgKey.get_async()
+        return self._copyConferencesToFormsAsync(
+            conferences, organisers).get_result()
+
+    @ndb.tasklet
+    def _copyConferencesToFormsAsync(self, conferences, organisers,
+                                     view=None):
+        """Copy a list of Conferences to ConferenceForms once the organizer
+        profile lookups complete.
+
+        Args:
+            conferences (list): Conferences to copy.
+            organisers (dict): Maps each organizer's Profile key to the
+                future of its lookup.
+            view (string): Name of the converter view used to copy them.
+        """
+        profiles = yield organisers.values()
+        # Put display names in a dict for easier fetching
+        names = {}
+        for profile in profiles:
+            if profile:
+                names[profile.key] = profile.displayName
+        raise ndb.Return([
+            self._copyConferenceToForm(
+                conf, names.get(conf.key.parent()), view)
+                    for conf in conferences
+        ])
+
+    @staticmethod
+    def _exportAttendees(websafeExportKey, websafeCursor=None, chunkId=1):
+        """Write the next batch of attendees of an export as CSV rows, then
+        queue the following batch; used by the attendee export task.
+        """
+        exportKey = ndb.Key(urlsafe=websafeExportKey)
+        export = exportKey.get()
+        if not export or export.status == 'DONE':
+            return
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        regKeys, nextCursor, more = Registration.query(
+            Registration.conference == export.conference).fetch_page(
+                EXPORT_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        # Each registration's parent is the attendee's profile
+        profiles = [p for p in ndb.get_multi([k.parent() for k in regKeys])
+                    if p]
+        output = StringIO()
+        writer = csv.writer(output)
+        if chunkId == 1:
+            writer.writerow(EXPORT_CSV_FIELDS)
+        for prof in profiles:
+            writer.writerow(
+                [_csvValue(getattr(prof, f)) for f in EXPORT_CSV_FIELDS])
+        done = not (more and nextCursor)
+
+        # Store the batch along with the export's progress. A retried task
+        # finds its batch already stored and only queues the next one.
+        @ndb.transactional()
+        def txn():
+            export = exportKey.get()
+            if chunkId <= export.chunkCount:
+                return
+            export.chunkCount = chunkId
+            export.attendeeCount += len(profiles)
+            if done:
+                export.status = 'DONE'
+            chunk = AttendeeExportChunk(
+                parent=exportKey, id=chunkId, data=output.getvalue())
+            ndb.put_multi([export, chunk])
+        txn()
+        if not done:
+            _queueAttendeeExportBatch(exportKey, nextCursor.urlsafe(),
+                                      chunkId + 1)
+
+    @staticmethod
+    def _getAttendeeExport(websafeExportKey, userId):
+        """Return the export referenced by the websafe key if it belongs to
+        the given user, else None.
+        """
+        try:
+            export = ndb.Key(urlsafe=websafeExportKey).get()
+        except:
+            return None
+        if not isinstance(export, AttendeeExport):
+            return None
+        if export.organizerUserId != userId:
+            return None
+        return export
+
+    @staticmethod
+    def _iterAttendeeExportChunks(export):
+        """Yield the CSV data of an export's batches, in order, without
+        loading them all at once.
+        """
+        query = AttendeeExportChunk.query(ancestor=export.key).order(
+            AttendeeExportChunk.key)
+        for chunk in query.iter(batch_size=10):
+            yield chunk.data
+
+    def _getOrganizedConference(self, websafeConferenceKey,
+                                action='access its attendees'):
+        """Return the conference, ensuring that the user organizes it."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        conf = _getEntityByWebsafeKey(websafeConferenceKey, 'Conference')
+        if user.email() != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the conference organizer can %s.' % action)
+        return conf
+
     def _createConferenceObject(self, request):
         """Create or update a conference, returning ConferenceForm/request."""
         # Preload necessary data items
@@ -248,30 +1268,18 @@ class ConferenceApi(remote.Service):
         if not request.name:
             raise endpoints.BadRequestException(
                 "Conference 'name' field required")
-        # Copy ConferenceForm/ProtoRPC Message into dict
-        data = {
-            field.name: getattr(request, field.name) for field in
-                request.all_fields()
-        }
-        del data['websafeKey']
-        del data['organizerDisplayName']
         # Add default values for those missing (both data model and
         # outbound Message)
         for df in CONF_DEFAULTS:
-            if data[df] in (None, []):
-                data[df] = CONF_DEFAULTS[df]
+            if getattr(request, df) in (None, []):
                 setattr(request, df, CONF_DEFAULTS[df])
-        # Convert dates from strings to Date objects; set month based
-        # on start_date
+        # Copy ConferenceForm/ProtoRPC Message into dict, converting dates
+        # from strings to Date objects; set month based on start_date
+        data = copyFromForm(request, Conference)
         if data['startDate']:
-            data['startDate'] = datetime.strptime(
-                data['startDate'][:10], "%Y-%m-%d").date()
             data['month'] = data['startDate'].month
         else:
             data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(
-                data['endDate'][:10], "%Y-%m-%d").date()
         # Set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
@@ -286,19 +1294,94 @@ class ConferenceApi(remote.Service):
         p_key = ndb.Key(Profile, user_id)
         data['parent'] = p_key
         data['organizerUserId'] = request.organizerUserId = user_id
-        # Create Conference, send email to organizer confirming
-        # creation of Conference and return (modified) ConferenceForm
-        Conference(**data).put()
+        # Store the organizer's display name, so that listings don't need
+        # to look up the profile
+        prof = self._getProfileFromUser()
+        data['organizerDisplayName'] = request.organizerDisplayName = (
+            prof.displayName)
+        # Create Conference along with its seat shards, send email to
+        # organizer confirming creation of Conference and return (modified)
+        # ConferenceForm
+        conf = Conference(**data)
+        confKey = conf.put()
+        ndb.put_multi(_newSeatShards(confKey, data['seatsAvailable']))
+        # Conferences with only a few seats are nearly sold out from the start
+        if _isNearlySoldOut(conf.seatsAvailable):
+            ndb.transaction(lambda: _updateAnnouncement(conf))
+        termindex.scheduleIndexUpdate(confKey, data['topics'])
+        textsearch.scheduleDocumentUpdate(confKey)
         taskqueue.add(params={'email': user.email(),
             'conferenceInfo': repr(request)},
             url='/tasks/send_confirmation_email'
         )
         return request
 
+    @ndb.tasklet
+    def _fetchConferenceFormsAsync(self, query, request, view=None,
+                                   **options):
+        """Fetch a page of conferences from the query, returning
+        ConferenceForms.
+
+        Conferences that predate the stored organizerDisplayName have their
+        organizer profile looked up as soon as they arrive, so the lookups
+        overlap with the remaining query batches. Each organizer is only
+        looked up once.
+
+        Args:
+            query (ndb.Query): Query that is to be executed.
+            request: Request message containing the paging fields.
+            view (string): Name of the converter view used to copy the
+                conferences. Must be given for projection queries.
+            **options: Additional query options, such as projection.
+        """
+        pageSize, cursor = _getPageOptions(request)
+        it = query.iter(limit=pageSize + 1, batch_size=pageSize,
+                        start_cursor=cursor, produce_cursors=True, **options)
+        conferences = []
+        organisers = {}
+        while (yield it.has_next_async()):
+            conf = it.next()
+            conferences.append(conf)
+            # The organizer's Profile is the parent of the conference
+            orgKey = conf.key.parent()
+            if not conf.organizerDisplayName and orgKey not in organisers:
+                organisers[orgKey] = orgKey.get_async()
+            if len(conferences) >= pageSize:
+                break
+        # Only return a token if there are more results
+        nextPageToken = None
+        if conferences and it.probably_has_next():
+            nextPageToken = it.cursor_after().urlsafe()
+        forms = yield self._copyConferencesToFormsAsync(
+            conferences, organisers, view)
+        raise ndb.Return(
+            ConferenceForms(items=forms, nextPageToken=nextPageToken))
+
+    @ndb.tasklet
+    def _fetchFilteredConferenceFormsAsync(self, query, filters, request,
+                                           view=None):
+        """Fetch a page of conferences from the query that also satisfy the
+        given in-memory filters, returning ConferenceForms.
+
+        At most MAX_SCAN_SIZE conferences are checked against the filters,
+        so the page may be short, but a nextPageToken is still returned.
+        """
+        conferences, nextPageToken = yield _fetchMatchingPageAsync(
+            query, request, lambda conf: _matchesFilters(conf, filters))
+        # Look up the organizers whose display name isn't stored
+        organisers = {}
+        for conf in conferences:
+            orgKey = conf.key.parent()
+            if not conf.organizerDisplayName and orgKey not in organisers:
+                organisers[orgKey] = orgKey.get_async()
+        forms = yield self._copyConferencesToFormsAsync(
+            conferences, organisers, view)
+        raise ndb.Return(
+            ConferenceForms(items=forms, nextPageToken=nextPageToken))
+
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
         for f in filters:
             filtr = {
                 field.name: getattr(f, field.name) for field in f.all_fields()
@@ -309,66 +1392,178 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException(
                     "Filter contains invalid field or operator.")
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # Check if inequality operation has been used in previous
-                # filters disallow the filter if inequality was performed on a
-                # different field before. Track the field on which the
-                # inequality operation is performed.
-                if inequality_field and inequality_field != filtr["field"]:
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except ValueError:
                     raise endpoints.BadRequestException(
-                        "Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+                        "Non-integer in integer field.")
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
     def _getConferencesByTopicSearch(self, request):
-        """Retrieve all conferences matching one or more given topics."""
-        # Generate list of filters from the topic arguments
-        filters = [Conference.topics == topic for topic in request.topics]
-        if not filters:
+        """Retrieve a page of keys of conferences matching the given topics,
+        ranked by the number of matching topics.
+        """
+        if not request.topics:
             raise endpoints.BadRequestException(
                 'At least one topic must be specified'
             )
-        # Retrieve all conferences matching one or more of the topic filters
-        conferences = Conference.query(
-            ndb.OR(*filters)).order(Conference.name).fetch()
-        return conferences
-
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+        # Look up the topics in the inverted index
+        return _termSearchPage('Conference', request.topics, request)
+
+    def _describePlan(self, plan):
+        """Return a human readable description of a query plan."""
+        def describe(filters):
+            return ' AND '.join(
+                '%s %s %r' % (f["field"], f["operator"], f["value"])
+                    for f in filters
+            ) or 'none'
+        order = ['name', '__key__']
+        if plan["inequalityField"]:
+            order.insert(0, plan["inequalityField"])
+        return 'datastore: %s; order: %s; memory: %s' % (
+            describe(plan["datastoreFilters"]), ', '.join(order),
+            describe(plan["memoryFilters"]))
+
+    def _getQuery(self, plan):
+        """Return formatted query from the datastore part of a query plan."""
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+        inequality_filter = plan["inequalityField"]
         # If exists, sort on inequality filter first
         if not inequality_filter:
             q = q.order(Conference.name)
         else:
             q = q.order(ndb.GenericProperty(inequality_filter))
             q = q.order(Conference.name)
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                try:
-                    filtr["value"] = int(filtr["value"])
-                except ValueError:
-                    raise endpoints.BadRequestException(
-                        "Non-integer in integer field.")
+        for filtr in plan["datastoreFilters"]:
             formatted_query = ndb.query.FilterNode(
                 filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
+        # Order by key last, so that cursors are stable
+        q = q.order(Conference.key)
         return q
 
-    @ndb.transactional()
+    def _planQuery(self, request):
+        """Split the submitted filters into those the datastore serves and
+        those that are applied in memory.
+
+        The datastore serves the first equality filter on each field, plus
+        the range filters on a single field; the indexes in index.yaml cover
+        every such combination. Among the fields that are only targeted by
+        range filters, the one bounded on both sides is preferred, since it
+        is likely the most selective. All other filters, including every
+        "!=" filter, are applied in memory.
+
+        Returns:
+            Dict containing the inequalityField (or None), the
+            datastoreFilters and the memoryFilters.
+        """
+        filters = self._formatFilters(request.filters)
+        equalityFields = set(
+            f["field"] for f in filters if f["operator"] == "=")
+        # Count the bounds (lower and upper) of each range filtered field
+        bounds = {}
+        rangeFields = []
+        for filtr in filters:
+            field = filtr["field"]
+            if filtr["operator"] in (">", ">="):
+                bound = 'lower'
+            elif filtr["operator"] in ("<", "<="):
+                bound = 'upper'
+            else:
+                continue
+            if field in equalityFields:
+                continue
+            if field not in bounds:
+                bounds[field] = set()
+                rangeFields.append(field)
+            bounds[field].add(bound)
+        inequality_field = None
+        for field in rangeFields:
+            if (not inequality_field or
+                    len(bounds[field]) > len(bounds[inequality_field])):
+                inequality_field = field
+        # Assign each filter to the datastore or memory
+        datastoreFilters = []
+        memoryFilters = []
+        seenEqualityFields = set()
+        for filtr in filters:
+            field = filtr["field"]
+            if filtr["operator"] == "=" and field not in seenEqualityFields:
+                seenEqualityFields.add(field)
+                datastoreFilters.append(filtr)
+            elif (field == inequality_field and
+                    filtr["operator"] in (">", ">=", "<", "<=")):
+                datastoreFilters.append(filtr)
+            else:
+                memoryFilters.append(filtr)
+        return {
+            "inequalityField": inequality_field,
+            "datastoreFilters": datastoreFilters,
+            "memoryFilters": memoryFilters,
+        }
+
+    @staticmethod
+    def _reconcileSeats(confs):
+        """Recount the registrations of a batch of conferences and give back
+        the seats that the seat shards still reserve for registrations that
+        were never written, e.g. when a group registration died after
+        reserving its seats; used by the seat reconciliation cron job.
+
+        The counts are read from the indexes, which may briefly miss
+        registrations made moments before, which is why this runs as a
+        daily job rather than along with every seat sync.
+        """
+        futures = [
+            (conf,
+             Registration.query(
+                Registration.conference == conf.key).count_async(),
+             # Registrations that are still in the legacy lists
+             Profile.query(Profile.conferenceKeysToAttend ==
+                           conf.key.urlsafe()).count_async())
+                for conf in confs
+        ]
+        for conf, registrations, legacy in futures:
+            released = _releaseLeakedSeats(
+                conf.key, registrations.get_result() + legacy.get_result())
+            if released:
+                logging.warning('Gave back %d leaked seats of %s', released,
+                                conf.key.urlsafe())
+                _scheduleSeatSync(conf.key)
+
+    @staticmethod
+    def _syncSeatsAvailable(websafeConferenceKey):
+        """Copy the total of the seat shards into the conference's
+        seatsAvailable property; used by the seat sync task.
+        """
+        confKey = raiseIfWebsafeKeyNotValid(websafeConferenceKey,
+                                            'Conference')
+        seatsAvailable = _countSeatsAvailable(_getSeatShards(confKey))
+        # Only write the conference when the total actually changed, and
+        # only touch the announcement when the conference crosses the
+        # nearly sold out threshold
+        @ndb.transactional(xg=True)
+        def txn():
+            conf = confKey.get()
+            if conf and conf.seatsAvailable != seatsAvailable:
+                wasNearlySoldOut = _isNearlySoldOut(conf.seatsAvailable)
+                conf.seatsAvailable = seatsAvailable
+                conf.put()
+                _invalidateCachedForms(ConferenceForm, [confKey])
+                if _isNearlySoldOut(seatsAvailable) != wasNearlySoldOut:
+                    _updateAnnouncement(conf)
+        txn()
+
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = user.email()
-        # Copy ConferenceForm/ProtoRPC Message into dict
-        data = {
-            field.name: getattr(request, field.name) for field in
-                request.all_fields()
-        }
+        # Copy ConferenceForm/ProtoRPC Message into dict, converting dates
+        # from strings to Date objects
+        data = copyFromForm(request, Conference)
         # Check that the conference to update actually exists
         conf = _getEntityByWebsafeKey(request.websafeConferenceKey,
                                       'Conference')
@@ -376,22 +1571,53 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
+        # Remember the topics, so the index can drop the ones removed, and
+        # whether the conference is in the announcement
+        oldTopics = list(conf.topics)
+        oldName = conf.name
+        wasNearlySoldOut = _isNearlySoldOut(conf.seatsAvailable)
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
-        for field in request.all_fields():
-            data = getattr(request, field.name)
+        for name, value in data.items():
+            # The number of available seats is maintained by the seat
+            # shards and the organizer's display name by the profile, so
+            # they can't be written directly
+            if name in ('seatsAvailable', 'organizerDisplayName'):
+                continue
             # Only copy fields where we get data
-            if data not in (None, []):
-                # Special handling for dates (convert string to Date)
-                if field.name in ('startDate', 'endDate'):
-                    data = datetime.strptime(data, "%Y-%m-%d").date()
-                    if field.name == 'startDate':
-                        conf.month = data.month
+            if value not in (None, []):
+                if name == 'startDate':
+                    conf.month = value.month
                 # Write to Conference object
-                setattr(conf, field.name, data)
+                setattr(conf, name, value)
+        # Spread the seats that are still free across the seat shards
+        # whenever maxAttendees changes
+        if request.maxAttendees is not None:
+            shards = _getSeatShards(conf.key)
+            reserved = sum(shard.reserved for shard in shards)
+            if conf.maxAttendees < reserved:
+                raise ConflictException(
+                    "'maxAttendees' is lower than the number of attendees "
+                    "already registered.")
+            seatsAvailable = conf.maxAttendees - reserved
+            for shard, free in zip(shards, _splitSeats(seatsAvailable)):
+                shard.capacity = shard.reserved + free
+            ndb.put_multi(shards)
+            conf.seatsAvailable = seatsAvailable
+        # Store the organizer's display name on conferences that predate it
+        if not conf.organizerDisplayName:
+            prof = conf.key.parent().get()
+            conf.organizerDisplayName = getattr(prof, 'displayName')
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        _invalidateCachedForms(ConferenceForm, [conf.key])
+        isNearlySoldOut = _isNearlySoldOut(conf.seatsAvailable)
+        if (isNearlySoldOut != wasNearlySoldOut or
+                (isNearlySoldOut and conf.name != oldName)):
+            _updateAnnouncement(conf)
+        if set(oldTopics) != set(conf.topics):
+            termindex.scheduleIndexUpdate(conf.key, oldTopics + conf.topics)
+        textsearch.scheduleDocumentUpdate(conf.key)
+        return self._copyConferenceToForm(conf)
 
 ###############################################################################
 ###         Conferences: Endpoints Methods
@@ -399,6 +1625,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @instrumented
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -406,52 +1633,81 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @instrumented
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or ""
+        # A single request at a time reloads a stale or evicted
+        # announcement from the datastore; the others serve the stale one
+        # or read the stored one themselves. Only the cron job rescans the
+        # conferences.
+        announcement = cache.getCachedValue(
+            MEMCACHE_ANNOUNCEMENTS_KEY,
+            _getStoredAnnouncement,
+            fallback=_getStoredAnnouncement,
+            softTtl=ANNOUNCEMENT_SOFT_TTL
+        )
         return StringMessage(data=announcement)
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @instrumented
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # Get Conference object from request; bail if not found
-        conf = _getEntityByWebsafeKey(request.websafeConferenceKey,
-                                      'Conference')
-        prof = conf.key.parent().get()
+        # Get ConferenceForm from memcache or datastore; bail if not found
+        confKey = raiseIfWebsafeKeyNotValid(request.websafeConferenceKey,
+                                            'Conference')
+        forms = _getCachedForms(ConferenceForm, [confKey],
+                                self._copyConferencesToForms)
+        if not forms:
+            raise endpoints.NotFoundException(
+                "No 'Conference' entity found using websafe key: %s" %
+                    request.websafeConferenceKey)
+        # The seatsAvailable stored on the conference is only synced from
+        # the seat shards periodically, so count the shards for an exact
+        # figure
+        shards = ndb.get_multi(_seatShardKeys(confKey))
+        if None not in shards:
+            forms[0].seatsAvailable = _countSeatsAvailable(shards)
         # Return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return forms[0]
 
     @endpoints.method(CONF_TOPICS_GET_REQUEST, ConferenceForms,
             path='conferences/topics',
             http_method='GET',
             name='getConferencesByTopicSearch')
+    @instrumented
     def getConferencesByTopicSearch(self, request):
-        """Get list of conferences matching one or more of the given topics."""
-        conferences = self._getConferencesByTopicSearch(request)
-        # Need to fetch organiser displayName from profiles
-        # Get all keys and use get_multi for speed
-        organisers = [
-            (ndb.Key(Profile, conf.organizerUserId)) for conf in conferences
-        ]
-        profiles = ndb.get_multi(organisers)
-        # Put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-        # Return individual ConferenceForm object per Conference
-        # Return individual ConferenceForm object per Conference
+        """Get list of conferences matching any or all of the given topics."""
+        confKeys, nextPageToken = self._getConferencesByTopicSearch(request)
+        # Return individual ConferenceForm object per Conference, rendering
+        # only those that aren't already in memcache
         return ConferenceForms(
-            items=[
-                self._copyConferenceToForm(conf, names[conf.organizerUserId])
-                    for conf in conferences
-            ]
+            items=_getCachedForms(ConferenceForm, confKeys,
+                                  self._copyConferencesToForms),
+            nextPageToken=nextPageToken
         )
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(SEARCH_GET_REQUEST, ConferenceForms,
+            path='search/conferences',
+            http_method='GET',
+            name='searchConferences')
+    @instrumented
+    def searchConferences(self, request):
+        """Full-text search over conference names, descriptions, topics and
+        cities, best match first.
+        """
+        confKeys, nextPageToken = _searchPage('Conference', request)
+        return ConferenceForms(
+            items=_getCachedForms(ConferenceForm, confKeys,
+                                  self._copyConferencesToForms),
+            nextPageToken=nextPageToken
+        )
+
+    @endpoints.method(PAGED_GET_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # Make sure user is authenticated
@@ -460,71 +1716,118 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = user.email()
         # Create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs, nextPageToken = _fetchPage(
+            Conference.query(ancestor=ndb.Key(Profile, user_id)), request)
         # Return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[
-                self._copyConferenceToForm(
-                    conf, getattr(prof, 'displayName')) for conf in confs
-            ]
+            items=self._copyConferencesToForms(confs),
+            nextPageToken=nextPageToken
         )
 
+    @endpoints.method(CONF_ATTENDEES_GET_REQUEST, AttendeeForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    @instrumented
+    def getConferenceAttendees(self, request):
+        """Get a page of the attendees of a conference (organizer only)."""
+        conf = self._getOrganizedConference(request.websafeConferenceKey)
+        regKeys, nextPageToken = _fetchPage(
+            Registration.query(Registration.conference == conf.key),
+            request, keys_only=True)
+        # Each registration's parent is the attendee's profile
+        profiles = ndb.get_multi([regKey.parent() for regKey in regKeys])
+        return AttendeeForms(
+            items=[copyToForm(prof, AttendeeForm) for prof in profiles if prof],
+            nextPageToken=nextPageToken
+        )
+
+    @endpoints.method(CONF_GET_REQUEST, AttendeeExportForm,
+            path='conference/{websafeConferenceKey}/attendees/export',
+            http_method='POST', name='exportConferenceAttendees')
+    @instrumented
+    def exportConferenceAttendees(self, request):
+        """Start a CSV export of the attendees of a conference (organizer
+        only). Poll getAttendeeExport for its download URL.
+        """
+        conf = self._getOrganizedConference(request.websafeConferenceKey)
+        export = AttendeeExport(conference=conf.key,
+                                organizerUserId=conf.organizerUserId)
+        export.put()
+        _queueAttendeeExportBatch(export.key, None, 1)
+        return self._copyAttendeeExportToForm(export)
+
+    @endpoints.method(ATTENDEE_EXPORT_GET_REQUEST, AttendeeExportForm,
+            path='attendeeexport/{websafeExportKey}',
+            http_method='GET', name='getAttendeeExport')
+    @instrumented
+    def getAttendeeExport(self, request):
+        """Return the progress of an attendee export."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        export = self._getAttendeeExport(request.websafeExportKey,
+                                         user.email())
+        if not export:
+            raise endpoints.NotFoundException(
+                'No attendee export found using websafe key: %s' %
+                    request.websafeExportKey)
+        return self._copyAttendeeExportToForm(export)
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences for which the user has registered."""
         prof = self._getProfileFromUser() # get user Profile
         conf_keys = [
-            ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend
+            ndb.Key(urlsafe=wsck)
+                for wsck in _getRegisteredConferenceKeys(prof)
         ]
-        conferences = ndb.get_multi(conf_keys)
-        # Get organizers
-        organisers = [
-            ndb.Key(Profile, conf.organizerUserId) for conf in conferences
-        ]
-        profiles = ndb.get_multi(organisers)
-        # Put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-        # Return set of ConferenceForm objects per Conference
+        # Return set of ConferenceForm objects per Conference, rendering
+        # only those that aren't already in memcache
         return ConferenceForms(
-            items=[
-                self._copyConferenceToForm(conf, names[conf.organizerUserId])
-                    for conf in conferences
-            ]
+            items=_getCachedForms(ConferenceForm, conf_keys,
+                                  self._copyConferencesToForms)
         )
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @instrumented
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
-        # Need to fetch organiser displayName from profiles
-        # Get all keys and use get_multi for speed
-        organisers = [
-            (ndb.Key(Profile, conf.organizerUserId)) for conf in conferences
-        ]
-        profiles = ndb.get_multi(organisers)
-        # Put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-        # Return individual ConferenceForm object per Conference
-        return ConferenceForms(
-            items=[
-                self._copyConferenceToForm(conf, names[conf.organizerUserId])
-                    for conf in conferences
-            ]
-        )
+        plan = self._planQuery(request)
+        query = self._getQuery(plan)
+        logging.debug('queryConferences plan: %s', self._describePlan(plan))
+        view = 'summary' if request.view == ListView.SUMMARY else None
+        if plan["memoryFilters"]:
+            # Stream the keys of the datastore results, applying the
+            # remaining filters to the entities in memory
+            forms = self._fetchFilteredConferenceFormsAsync(
+                query, plan["memoryFilters"], request, view).get_result()
+        else:
+            # The summary view only returns the fields shown in conference
+            # listings. Without filters, those are read from the index with
+            # a projection query instead of loading the entities.
+            options = {}
+            if view and not plan["datastoreFilters"]:
+                # Conferences that predate the stored organizer display
+                # name are left out until they are backfilled
+                options['projection'] = CONF_SUMMARY_FIELDS
+            # Return individual ConferenceForm object per Conference,
+            # fetching organiser displayName while the query streams
+            forms = self._fetchConferenceFormsAsync(
+                query, request, view, **options).get_result()
+        if request.explain:
+            forms.queryPlan = self._describePlan(plan)
+        return forms
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @instrumented
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -532,13 +1835,23 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @instrumented
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
 
+    @endpoints.method(CONF_GROUP_POST_REQUEST, RegistrationResultForms,
+            path='conference/{websafeConferenceKey}/registergroup',
+            http_method='POST', name='registerGroupForConference')
+    @instrumented
+    def registerGroupForConference(self, request):
+        """Register a group of users (by email) for selected conference."""
+        return self._conferenceGroupRegistration(request)
+
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @instrumented
     def updateConference(self, request):
         """Update conference with provided fields and return updated info."""
         return self._updateConferenceObject(request)
@@ -549,14 +1862,35 @@ class ConferenceApi(remote.Service):
 
     def _copySpeakerToForm(self, speaker):
         """Copy relevant fields from Speaker to SpeakerForm."""
-        sf = SpeakerForm()
-        for field in sf.all_fields():
-            if hasattr(speaker, field.name):
-                setattr(sf, field.name, getattr(speaker, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, speaker.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return copyToForm(speaker, SpeakerForm)
+
+    def _copySpeakersToForms(self, speakers):
+        """Copy a list of Speakers to SpeakerForms."""
+        return [self._copySpeakerToForm(speaker) for speaker in speakers]
+
+    @staticmethod
+    def _migrateSpeakers(speakers):
+        """Compute the session counters of a batch of speakers from their
+        sessions and drop their legacy sessions list; used by the speaker
+        migration task.
+        """
+        queries = [
+            Session.query(Session.speaker == speaker.key).fetch_async()
+                for speaker in speakers
+        ]
+        # Each counter and speaker is its own entity group, so store them
+        # in parallel transactions, which don't overwrite sessions counted
+        # or imported concurrently
+        futures = []
+        for speaker, query in zip(speakers, queries):
+            futures.extend(
+                _mergeSpeakerStatsAsync(stats) for stats in
+                    _countSpeakerSessions(speaker.key, query.get_result()))
+            if speaker.sessions:
+                futures.append(_dropLegacySpeakerSessionsAsync(speaker.key))
+        ndb.Future.wait_all(futures)
+        for future in futures:
+            future.check_success()
 
     def _createSpeakerObject(self, request):
         """Create a speaker, returning SpeakerForm/request."""
@@ -568,52 +1902,50 @@ class ConferenceApi(remote.Service):
         if not request.name:
             raise endpoints.BadRequestException(
                 "Speaker 'name' field required")
-        # Copy SpeakerForm/ProtoRPC Message into dict
-        data = {
-            field.name: getattr(request, field.name) for field in
-                request.all_fields()
-        }
-        del data['websafeKey']
-        # Add default values for those missing (both data model and
-        # outbound Message)
-        for df in SPEAKER_DEFAULTS:
-            if data[df] in (None, []):
-                data[df] = SPEAKER_DEFAULTS[df]
+        # Copy SpeakerForm/ProtoRPC Message into dict, adding default
+        # values for those missing in the data model
+        data = copyFromForm(request, Speaker, SPEAKER_DEFAULTS)
         # Create Speaker and return SpeakerForm
         speaker = Speaker(**data)
         speaker.put()
+        textsearch.scheduleDocumentUpdate(speaker.key)
         return self._copySpeakerToForm(speaker)
 
     @staticmethod
     def _updateFeaturedSpeaker(websafeSpeakerKey, websafeConferenceKey):
         """Check if the specified speaker is speaking at multiple sessions
-        in the specified conference, and create memcache entry if so.
+        in the specified conference, and make them the conference's featured
+        speaker if so.
         """
         # Validate the websafe key arguments. Exception is raised if either
         # call fails.
         speaker = _getEntityByWebsafeKey(websafeSpeakerKey, 'Speaker')
-        confKey = _raiseIfWebsafeKeyNotValid(websafeConferenceKey,
-                                             'Conference')
-        # Get all sessions by the specified speaker at the specified
-        # conference. Use a projection query, since the only information we're
-        # interested in from the session entities is their name.
-        sessionsBySpeaker = Session.query(
-            Session.speaker == speaker.key,
-            Session.conference == confKey
-        ).fetch(projection=[Session.name])
+        confKey = raiseIfWebsafeKeyNotValid(websafeConferenceKey,
+                                            'Conference')
+        # Get the speaker's session counter for the conference. It is
+        # read by key, so it already includes the sessions just added.
+        stats = speakerStatsKey(speaker.key, confKey).get()
         # If there are fewer than two sessions, return immediately since
         # there is nothing left to do
-        if len(sessionsBySpeaker) < 2:
+        if not stats or stats.sessionCount < 2:
             return
         # Put the session names into a list, alphabetically
-        sessionNames = sorted([s.name for s in sessionsBySpeaker])
+        sessionNames = sorted(stats.sessionNames)
         # Generate the featured speaker message
         featuredSpeakerMsg = (
             'Our featured speaker is {}, who will be speaking at the following '
             'sessions: {}'.format(speaker.name, ', '.join(sessionNames))
         )
-        # Set the memcache entry to the new featured speaker message
-        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, featuredSpeakerMsg)
+        # Store the conference's featured speaker, then refresh the
+        # memcache entry in front of it
+        FeaturedSpeaker(
+            id=websafeConferenceKey,
+            speaker=speaker.key,
+            message=featuredSpeakerMsg
+        ).put()
+        cache.setCachedValue(
+            MEMCACHE_FEATURED_SPEAKER_PREFIX + websafeConferenceKey,
+            featuredSpeakerMsg, FEATURED_SPEAKER_SOFT_TTL)
 
 ###############################################################################
 ###         Speakers: Endpoints Methods
@@ -621,36 +1953,74 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(SpeakerForm, SpeakerForm, path='speaker',
             http_method='POST', name='createSpeaker')
+    @instrumented
     def createSpeaker(self, request):
         """Create new speaker."""
         return self._createSpeakerObject(request)
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(CONF_GET_REQUEST, StringMessage,
             path='speaker/featured', http_method='GET',
             name='getFeaturedSpeaker')
+    @instrumented
     def getFeaturedSpeaker(self, request):
-        """Return the current featured speaker message from memcache."""
-        message = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or ""
+        """Return the featured speaker message of a conference."""
+        confKey = raiseIfWebsafeKeyNotValid(request.websafeConferenceKey,
+                                            'Conference')
+        websafeConferenceKey = confKey.urlsafe()
+        # Usually served by a single memcache lookup. A single request at a
+        # time reloads a stale or evicted message from the datastore, and
+        # an empty message is cached for conferences without one.
+        message = cache.getCachedValue(
+            MEMCACHE_FEATURED_SPEAKER_PREFIX + websafeConferenceKey,
+            lambda: _getStoredFeaturedSpeaker(websafeConferenceKey),
+            softTtl=FEATURED_SPEAKER_SOFT_TTL
+        )
         return StringMessage(data=message)
 
     @endpoints.method(SPEAKER_GET_REQUEST, SpeakerForm, path='speaker',
             http_method='GET', name='getSpeaker')
+    @instrumented
     def getSpeaker(self, request):
         """Return requested speaker (by websafeSpeakerKey)."""
-        # Get Speaker object from request; bail if not found
-        speaker = _getEntityByWebsafeKey(request.websafeSpeakerKey,
-                                         'Speaker')
+        # Get SpeakerForm from memcache or datastore; bail if not found
+        speakerKey = raiseIfWebsafeKeyNotValid(request.websafeSpeakerKey,
+                                               'Speaker')
+        forms = _getCachedForms(SpeakerForm, [speakerKey],
+                                self._copySpeakersToForms)
+        if not forms:
+            raise endpoints.NotFoundException(
+                "No 'Speaker' entity found using websafe key: %s" %
+                    request.websafeSpeakerKey)
         # Return SpeakerForm
-        return self._copySpeakerToForm(speaker)
+        return forms[0]
 
-    @endpoints.method(message_types.VoidMessage, SpeakerForms,
+    @endpoints.method(PAGED_GET_REQUEST, SpeakerForms,
             path='speakers', http_method='GET', name='getSpeakers')
+    @instrumented
     def getSpeakers(self, request):
         """Get list of all speakers in the system."""
-        speakers = Speaker.query().order(Speaker.name).fetch()
+        speakers, nextPageToken = _fetchPage(
+            Speaker.query().order(Speaker.name), request)
         # Return individual SpeakerForm object per Speaker
         return SpeakerForms(
-            items=[self._copySpeakerToForm(speaker) for speaker in speakers]
+            items=[self._copySpeakerToForm(speaker) for speaker in speakers],
+            nextPageToken=nextPageToken
+        )
+
+    @endpoints.method(SEARCH_GET_REQUEST, SpeakerForms,
+            path='search/speakers',
+            http_method='GET',
+            name='searchSpeakers')
+    @instrumented
+    def searchSpeakers(self, request):
+        """Full-text search over speaker names and companies, best match
+        first.
+        """
+        speakerKeys, nextPageToken = _searchPage('Speaker', request)
+        return SpeakerForms(
+            items=_getCachedForms(SpeakerForm, speakerKeys,
+                                  self._copySpeakersToForms),
+            nextPageToken=nextPageToken
         )
 
 ###############################################################################
@@ -659,18 +2029,19 @@ class ConferenceApi(remote.Service):
 
     def _addSessionToWishlist(self, request):
         """Add a session to the user's wishlist, returning a boolean."""
-        # Preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        # Verify that the session actually exists
-        session = _getEntityByWebsafeKey(request.websafeSessionKey, 'Session')
-        profile = self._getProfileFromUser()
-        if session.key not in profile.sessionWishlist:
-            profile.sessionWishlist.append(session.key)
-            profile.put()
+        self._updateWishlist([request.websafeSessionKey],
+                             rejectConflicts=request.rejectConflicts)
         return BooleanMessage(data=True)
 
+    @staticmethod
+    def _backfillSessionTimeSlots(sessions):
+        """Store the computed time slot of a batch of sessions that may
+        predate the timeSlot property; used by the backfill task.
+        """
+        # Writing a session stores the current value of its computed
+        # properties
+        ndb.put_multi(sessions)
+
     @ndb.transactional(xg=True)
     def _createSessionObject(self, request):
         """Create a session, returning SessionForm/request."""
@@ -692,119 +2063,156 @@ class ConferenceApi(remote.Service):
         if not request.name:
             raise endpoints.BadRequestException(
                 "Session 'name' field required")
-        # Copy SessionForm/ProtoRPC Message into dict
-        data = {
-            field.name: getattr(request, field.name) for field in
-                request.all_fields()
-        }
-        # Remove data that isn't destined for the Session entity
-        del data['websafeConferenceKey']
-        del data['websafeSpeakerKey']
-        del data['websafeKey']
-        # Add default values for those missing in the data model
-        for df in SESSION_DEFAULTS:
-            if data[df] in (None, []):
-                data[df] = SESSION_DEFAULTS[df]
-        # Ensure the string version of typeOfSession is what is stored
-        # in the NDB model
-        data['typeOfSession'] = str(data['typeOfSession'])
-        # Convert date from string to Date object
-        if data['date'] is not None:
-            try:
-                data['date'] = datetime.strptime(
-                    data['date'][:10], '%Y-%m-%d').date()
-            except:
-                raise endpoints.BadRequestException(
-                    "Invalid 'date' value")
-        # Convert startTime from string to Time object
-        if data['startTime'] is not None:
-            try:
-                data['startTime'] = datetime.strptime(
-                    data['startTime'], '%H:%M').time()
-            except:
-                raise endpoints.BadRequestException(
-                    "Invalid 'startTime' value")
+        # Copy SessionForm/ProtoRPC Message into dict, adding default values
+        # for those missing in the data model. The date and startTime
+        # strings are converted to Date and Time objects, and the string
+        # version of typeOfSession is what is stored in the NDB model.
+        data = copyFromForm(request, Session, SESSION_DEFAULTS)
         # Create Session
         session = Session(**data)
         session.conference = conf.key
         session.speaker = speaker.key
         session.put()
-        # Add the session key to the speaker's sessions list
-        speaker.sessions.append(session.key)
-        speaker.put()
-        # Add a task to task queue which checks if the speaker of this session
-        # should be the new featured speaker
-        taskqueue.add(params={'websafeSpeakerKey': request.websafeSpeakerKey,
-            'websafeConferenceKey': request.websafeConferenceKey},
-            url='/tasks/update_featured_speaker'
-        )
+        termindex.scheduleIndexUpdate(session.key, session.highlights)
+        textsearch.scheduleDocumentUpdate(session.key)
+        # Count the speaker's sessions at this conference. The counter is
+        # its own entity group, so only sessions of the same speaker at the
+        # same conference contend on it, and the speaker isn't written.
+        statsKey = speakerStatsKey(speaker.key, conf.key)
+        stats = statsKey.get() or SpeakerConferenceStats(
+            key=statsKey, speaker=speaker.key, conference=conf.key)
+        stats.sessionCount += 1
+        stats.sessionNames.append(session.name)
+        stats.put()
+        invalidateAgenda(conf.key)
+        # A speaker with multiple sessions at the conference becomes the
+        # featured speaker once this transaction commits
+        if stats.sessionCount >= 2:
+            ndb.get_context().call_on_commit(
+                lambda: scheduleFeaturedSpeakerUpdate(speaker.key, conf.key))
         # Return SessionForm object
         return self._copySessionToForm(session)
 
-    def _copySessionToForm(self, session):
+    def _buildAgenda(self, confKey):
+        """Render the agenda of a conference: its sessions grouped by day,
+        each with a summary of its speaker.
+        """
+        sessions = Session.query(Session.conference == confKey).fetch()
+        sessions.sort(key=lambda s: (s.date, s.startTime, s.key))
+        # Look up all speakers of the conference with one batch get
+        speakerKeys = list(set(session.speaker for session in sessions))
+        speakerForms = {}
+        for speaker in ndb.get_multi(speakerKeys):
+            if speaker:
+                speakerForms[speaker.key] = copyToForm(
+                    speaker, SpeakerForm, 'summary')
+        days = []
+        for day, daySessions in itertools.groupby(sessions,
+                                                  lambda s: s.date):
+            days.append(AgendaDayForm(
+                date=day.strftime('%Y-%m-%d') if day else None,
+                sessions=[
+                    AgendaSessionForm(
+                        session=self._copySessionToForm(session),
+                        speaker=speakerForms.get(session.speaker))
+                        for session in daySessions
+                ]
+            ))
+        return AgendaForm(websafeConferenceKey=confKey.urlsafe(), days=days)
+
+    def _copySessionImportToForm(self, sessionImport):
+        """Copy relevant fields from SessionImport to
+        SessionImportStatusForm.
+        """
+        return SessionImportStatusForm(
+            websafeKey=sessionImport.key.urlsafe(),
+            websafeConferenceKey=sessionImport.conference.urlsafe(),
+            status=sessionImport.status,
+            error=sessionImport.error,
+            rowCount=sessionImport.rowCount,
+            importedCount=sessionImport.importedCount
+        )
+
+    def _copySessionToForm(self, session, view=None):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                # Convert date field to date string
-                if field.name == 'date':
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                # Convert time field to time string
-                elif field.name == 'startTime':
-                    setattr(sf, field.name,
-                            getattr(session, field.name).strftime('%H:%M'))
-                # Convert typeOfSession string field to enum
-                elif field.name == 'typeOfSession':
-                    setattr(sf, field.name,
-                        getattr(SessionType, getattr(session, field.name)))
-                # Copy other fields verbatim
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-            # Ensure that the SessionForm contains websafeKey
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, session.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return copyToForm(session, SessionForm, view)
+
+    def _copySessionsToForms(self, sessions):
+        """Copy a list of Sessions to SessionForms."""
+        return [self._copySessionToForm(session) for session in sessions]
+
+    def _getConferenceAgenda(self, request):
+        """Retrieve the agenda of a conference, reading through memcache."""
+        # Ensure that websafeConferenceKey is a valid conference key
+        confKey = raiseIfWebsafeKeyNotValid(request.websafeConferenceKey,
+                                            'Conference')
+        cacheKey = MEMCACHE_AGENDA_PREFIX + request.websafeConferenceKey
+        payload = memcache.get(cacheKey)
+        if payload:
+            return protobuf.decode_message(AgendaForm, payload)
+        agenda = self._buildAgenda(confKey)
+        # Add rather than set, which fails while the agenda is locked after
+        # a change
+        memcache.add(cacheKey, protobuf.encode_message(agenda),
+                     time=MEMCACHE_FORM_TIME)
+        return agenda
 
     def _getConferenceSessions(self, request):
-        """Retrieve all sessions associated with a conference."""
+        """Retrieve a page of sessions associated with a conference."""
         # Ensure that websafeConferenceKey is a valid conference key
-        confKey = _raiseIfWebsafeKeyNotValid(request.websafeConferenceKey,
-                                             'Conference')
-        # Retrieve all sessions that have a matching conference key
-        sessions = Session.query(Session.conference == confKey).fetch()
-        return sessions
+        confKey = raiseIfWebsafeKeyNotValid(request.websafeConferenceKey,
+                                            'Conference')
+        # Retrieve sessions that have a matching conference key. The summary
+        # view is read from the index with a projection query.
+        query = Session.query(Session.conference == confKey)
+        if request.view == ListView.SUMMARY:
+            return _fetchPage(query, request,
+                              projection=SESSION_SUMMARY_FIELDS)
+        return _fetchPage(query, request)
 
     def _getConferenceSessionsByType(self, request):
-        """Retrieve all sessions associated with a conference, by type."""
+        """Retrieve a page of sessions associated with a conference, by type.
+        """
         # Ensure that websafeConferenceKey is a valid conference key
-        confKey = _raiseIfWebsafeKeyNotValid(request.websafeConferenceKey,
-                                             'Conference')
-        # Retrieve all sessions that have a matching conference key, by type
-        sessions = Session.query(
+        confKey = raiseIfWebsafeKeyNotValid(request.websafeConferenceKey,
+                                            'Conference')
+        # Retrieve sessions that have a matching conference key, by type
+        query = Session.query(
             Session.conference == confKey,
             Session.typeOfSession == str(request.typeOfSession)
-        ).fetch()
-        return sessions
+        )
+        return _fetchPage(query, request)
 
     def _getSessionsByHighlightSearch(self, request):
-        """Retrieve all sessions matching one or more given highlights."""
-        # Generate list of filters from the highlight arguments
-        filters = [Session.highlights == hl for hl in request.highlights]
-        if not filters:
+        """Retrieve a page of keys of sessions matching the given highlights,
+        ranked by the number of matching highlights.
+        """
+        if not request.highlights:
             raise endpoints.BadRequestException(
                 'At least one highlight must be specified'
             )
-        # Retrieve all sessions that match one or more of the highlight filters
-        sessions = Session.query(ndb.OR(*filters)).order(Session.name).fetch()
-        return sessions
+        # Look up the highlights in the inverted index
+        return _termSearchPage('Session', request.highlights, request)
 
     def _getSessionsBySpeaker(self, request):
-        """Retrieve all sessions given by a particular speaker."""
+        """Retrieve a page of the sessions given by a particular speaker,
+        optionally only those at one conference.
+        """
         # Ensure that the speaker key is valid and that the speaker exists
         speaker = _getEntityByWebsafeKey(request.websafeSpeakerKey, 'Speaker')
-        # Return all of the speaker's sessions
-        return ndb.get_multi(speaker.sessions)
+        query = Session.query(Session.speaker == speaker.key)
+        if request.websafeConferenceKey:
+            confKey = raiseIfWebsafeKeyNotValid(
+                request.websafeConferenceKey, 'Conference')
+            query = query.filter(Session.conference == confKey)
+        query = query.order(Session.date, Session.startTime, Session.key)
+        # Read the page of keys from the index, then return forms for the
+        # sessions, rendering only those that aren't already in memcache
+        sessionKeys, nextPageToken = _fetchPage(query, request,
+                                                keys_only=True)
+        return (_getCachedForms(SessionForm, sessionKeys,
+                                self._copySessionsToForms),
+                nextPageToken)
 
     def _getSessionsDoubleInequalityDemo(self, request):
         """Demonstrates my solution to the double-inequality query problem."""
@@ -823,39 +2231,212 @@ class ConferenceApi(remote.Service):
         # Generate a list of equality filters from the sessionTypes list
         equalityFilters = [Session.typeOfSession == st for st in sessionTypes]
         # Construct query, utilizing the list of equality filters in an OR
-        # function. Add the startTime inequality filter. Then execute.
+        # function. Add the startTime inequality filter. Then execute,
+        # ordering by key last since cursors are required on an OR query.
         query = Session.query(ndb.OR(*equalityFilters))
         query = query.filter(Session.startTime <= maxStartTime)
-        sessions = query.order(Session.startTime).fetch()
-        return sessions
+        query = query.order(Session.startTime, Session.key)
+        return _fetchPage(query, request)
 
-    def _getSessionsInWishlist(self):
-        """Retrieve all sessions in the user's wishlist."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+    def _getSessionsInWishlist(self, request):
+        """Retrieve a page of the sessions in the user's wishlist, optionally
+        only those of one conference.
+        """
+        profile = self._getProfileFromUser()
+        sessionKeys = profile.sessionWishlist
+        if request.websafeConferenceKey:
+            confKey = raiseIfWebsafeKeyNotValid(
+                request.websafeConferenceKey, 'Conference')
+            # Keys-only scan of the conference's sessions, read from the
+            # index, to check wishlist entries against
+            confSessionKeys = set(Session.query(
+                Session.conference == confKey).iter(keys_only=True))
+            sessionKeys = [key for key in sessionKeys
+                           if key in confSessionKeys]
+        sessionKeys, nextPageToken = _pageOfList(sessionKeys, request)
+        # Return forms for the sessions, rendering only those that aren't
+        # already in memcache
+        return (_getCachedForms(SessionForm, sessionKeys,
+                                self._copySessionsToForms),
+                nextPageToken)
+
+    def _getWishlistConflicts(self, request):
+        """Retrieve the pairs of overlapping sessions in the user's
+        wishlist, optionally only among the conferences the user is
+        registered for.
+        """
         profile = self._getProfileFromUser()
-        # Fetch the entities and return them
-        return ndb.get_multi(profile.sessionWishlist)
+        # Load the whole wishlist with one batch get, which NDB mostly
+        # serves from memcache
+        sessions = [s for s in ndb.get_multi(profile.sessionWishlist) if s]
+        if request.registeredOnly:
+            wscks = set(_getRegisteredConferenceKeys(profile))
+            sessions = [s for s in sessions
+                        if s.conference.urlsafe() in wscks]
+        return SessionConflictForms(items=[
+            SessionConflictForm(first=self._copySessionToForm(first),
+                                second=self._copySessionToForm(second))
+                for first, second in _findConflicts(sessions)
+        ])
+
+    @staticmethod
+    def _importSessions(websafeImportKey, step, retryCount=0):
+        """Run one step of a session import; used by the session import
+        task.
+        """
+        sessionimport.runStep(websafeImportKey, step, retryCount)
+
+    def _querySessions(self, request):
+        """Retrieve a page of sessions matching the given schedule criteria,
+        in chronological order.
+
+        The conference and speaker are equality filters. The date range,
+        together with the start times on its first and last days, is a
+        single range filter on the precomputed Session.timeSlot. Start
+        times on the days in between, duration bounds and excluded types
+        are checked in memory on at most MAX_SCAN_SIZE sessions per page.
+        """
+        query = Session.query()
+        if request.websafeConferenceKey:
+            confKey = raiseIfWebsafeKeyNotValid(
+                request.websafeConferenceKey, 'Conference')
+            query = query.filter(Session.conference == confKey)
+        if request.websafeSpeakerKey:
+            speakerKey = raiseIfWebsafeKeyNotValid(
+                request.websafeSpeakerKey, 'Speaker')
+            query = query.filter(Session.speaker == speakerKey)
+        startDate = _parseField(request, 'startDate', '%Y-%m-%d')
+        endDate = _parseField(request, 'endDate', '%Y-%m-%d')
+        earliest = _parseField(request, 'earliestStartTime', '%H:%M')
+        latest = _parseField(request, 'latestStartTime', '%H:%M')
+        earliest = earliest.time() if earliest else dtime.min
+        latest = latest.time() if latest else dtime.max
+        if startDate:
+            query = query.filter(
+                Session.timeSlot >= toTimeSlot(startDate.date(), earliest))
+        if endDate:
+            query = query.filter(
+                Session.timeSlot <= toTimeSlot(endDate.date(), latest))
+        query = query.order(Session.timeSlot, Session.key)
+        excludedTypes = set(str(t) for t in request.excludedTypes)
+        minDuration = request.minDuration
+        maxDuration = request.maxDuration
+
+        def matches(session):
+            if session.typeOfSession in excludedTypes:
+                return False
+            minute = session.timeSlot % MINUTES_PER_DAY
+            if not (earliest.hour * 60 + earliest.minute <= minute <=
+                    latest.hour * 60 + latest.minute):
+                return False
+            if minDuration is not None and session.duration < minDuration:
+                return False
+            if maxDuration is not None and session.duration > maxDuration:
+                return False
+            return True
+
+        # Without in-memory criteria, the query alone yields the page
+        if not (excludedTypes or request.earliestStartTime or
+                request.latestStartTime or minDuration is not None or
+                maxDuration is not None):
+            return _fetchPage(query, request)
+        return _fetchMatchingPageAsync(query, request, matches).get_result()
 
     def _removeSessionFromWishlist(self, request):
         """Removes a session from the user's wishlist, returning a boolean."""
-        # Preload necessary data items
+        return BooleanMessage(
+            data=self._updateWishlist([request.websafeSessionKey], add=False))
+
+    def _updateWishlist(self, websafeSessionKeys, add=True,
+                        rejectConflicts=False):
+        """Add sessions to or remove sessions from the user's wishlist,
+        returning whether the wishlist changed.
+
+        Args:
+            websafeSessionKeys (list): Websafe keys of the sessions.
+            add (bool): Whether to add the sessions, rather than remove them.
+            rejectConflicts (bool): Whether to refuse adding sessions that
+                overlap with each other or with the wishlist.
+
+        Raises:
+            endpoints.BadRequestException: Occurs if no keys or too many
+                keys are given, or if a key is not a valid session key.
+            endpoints.NotFoundException: Occurs if a session to be added
+                doesn't exist.
+            ConflictException: Occurs if rejectConflicts is set and a
+                session to be added overlaps with another one.
+        """
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
+        # Decode the keys, removing duplicates while preserving order
+        sessionKeys = []
+        seen = set()
+        for websafeSessionKey in websafeSessionKeys:
+            key = raiseIfWebsafeKeyNotValid(websafeSessionKey, 'Session')
+            if key not in seen:
+                seen.add(key)
+                sessionKeys.append(key)
+        if not sessionKeys:
+            raise endpoints.BadRequestException(
+                'At least one session key must be specified')
+        if len(sessionKeys) > MAX_WISHLIST_UPDATE:
+            raise endpoints.BadRequestException(
+                'At most %d session keys may be specified' %
+                    MAX_WISHLIST_UPDATE)
+        # Verify that the sessions to be added exist with one batch get.
+        # Removing a session that no longer exists is allowed.
+        if add:
+            sessions = ndb.get_multi(sessionKeys)
+            missing = [
+                key.urlsafe() for key, session in zip(sessionKeys, sessions)
+                    if not session
+            ]
+            if missing:
+                raise endpoints.NotFoundException(
+                    "No 'Session' entity found using websafe key: %s" %
+                        ', '.join(missing))
+            if rejectConflicts:
+                self._raiseIfConflicting(sessions)
+        return self._updateWishlistTxn(sessionKeys, add)
+
+    def _raiseIfConflicting(self, sessions):
+        """Raise ConflictException if any of the sessions to be added to
+        the user's wishlist overlap with each other or with the wishlist.
+
+        The check reads the sessions outside of the wishlist transaction,
+        since they are in other entity groups, so it doesn't guard against
+        concurrent additions by the same user.
+        """
         profile = self._getProfileFromUser()
-        # Get actual session key from websafe key
-        sessionKey = _raiseIfWebsafeKeyNotValid(request.websafeSessionKey,
-                                                'Session')
-        # If the key is in the profile's session wishlist, remove it
-        if sessionKey in profile.sessionWishlist:
-            profile.sessionWishlist.remove(sessionKey)
-            profile.put()
-            retval = True
+        newKeys = set(session.key for session in sessions)
+        wishlist = ndb.get_multi(
+            [key for key in profile.sessionWishlist if key not in newKeys])
+        for first, second in _findConflicts(
+                [s for s in wishlist if s] + sessions):
+            if first.key in newKeys or second.key in newKeys:
+                raise ConflictException(
+                    "Session '%s' overlaps with session '%s'" %
+                        (first.name, second.name))
+
+    @ndb.transactional()
+    def _updateWishlistTxn(self, sessionKeys, add):
+        """Apply a wishlist change to the user's profile with a single put,
+        returning whether the wishlist changed.
+        """
+        profile = self._getProfileFromUser()
+        wishlist = set(profile.sessionWishlist)
+        if add:
+            changed = [key for key in sessionKeys if key not in wishlist]
+            profile.sessionWishlist.extend(changed)
         else:
-            retval = False
-        return BooleanMessage(data=retval)
+            changed = wishlist.intersection(sessionKeys)
+            profile.sessionWishlist = [
+                key for key in profile.sessionWishlist if key not in changed
+            ]
+        if changed:
+            profile.put()
+        return bool(changed)
 
 ###############################################################################
 ###         Sessions: Endpoints Methods
@@ -864,73 +2445,160 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
             path='conference/{websafeConferenceKey}/createsession',
             http_method='POST', name='createSession')
+    @instrumented
     def createSession(self, request):
         """Create new session."""
         return self._createSessionObject(request)
 
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSION_IMPORT_POST_REQUEST, SessionImportStatusForm,
+            path='conference/{websafeConferenceKey}/sessions/import',
+            http_method='POST', name='importSessions')
+    @instrumented
+    def importSessions(self, request):
+        """Start a bulk import of sessions from CSV or JSON rows (organizer
+        only). Poll getSessionImport for its progress.
+        """
+        conf = self._getOrganizedConference(request.websafeConferenceKey,
+                                            'import sessions into it')
+        return self._copySessionImportToForm(sessionimport.createImport(
+            conf, request.format, request.data))
+
+    @endpoints.method(SESSION_IMPORT_GET_REQUEST, SessionImportStatusForm,
+            path='sessionimport/{websafeImportKey}',
+            http_method='GET', name='getSessionImport')
+    @instrumented
+    def getSessionImport(self, request):
+        """Return the progress of a session import."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        sessionImport = sessionimport.getImport(request.websafeImportKey,
+                                                user.email())
+        if not sessionImport:
+            raise endpoints.NotFoundException(
+                'No session import found using websafe key: %s' %
+                    request.websafeImportKey)
+        return self._copySessionImportToForm(sessionImport)
+
+    @endpoints.method(CONF_GET_REQUEST, AgendaForm,
+            path='conference/{websafeConferenceKey}/agenda',
+            http_method='GET',
+            name='getConferenceAgenda')
+    @instrumented
+    def getConferenceAgenda(self, request):
+        """Get the sessions of a conference grouped by day, in order of
+        start time, with a summary of each session's speaker.
+        """
+        return self._getConferenceAgenda(request)
+
+    @endpoints.method(CONF_SESSIONS_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/sessions',
             http_method='GET',
             name='getConferenceSessions')
+    @instrumented
     def getConferenceSessions(self, request):
         """Get list of sessions associated with a conference."""
-        sessions = self._getConferenceSessions(request)
+        sessions, nextPageToken = self._getConferenceSessions(request)
+        view = 'summary' if request.view == ListView.SUMMARY else None
         # Return individual SessionForm object per Session
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[
+                self._copySessionToForm(session, view) for session in sessions
+            ],
+            nextPageToken=nextPageToken
         )
 
     @endpoints.method(SESSIONTYPE_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/sessionsbytype',
             http_method='GET',
             name='getConferenceSessionsByType')
+    @instrumented
     def getConferenceSessionsByType(self, request):
         """Get list of sessions associated with a conference (by type)."""
-        sessions = self._getConferenceSessionsByType(request)
+        sessions, nextPageToken = self._getConferenceSessionsByType(request)
         # Return individual SessionForm object per Session
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=nextPageToken
         )
 
     @endpoints.method(SESSION_HIGHLIGHTS_GET_REQUEST, SessionForms,
             path='sessions/highlights',
             http_method='GET',
             name='getSessionsByHighlightSearch')
+    @instrumented
     def getSessionsByHighlightSearch(self, request):
-        """Get list of sessions matching one or more of the given highlights."""
-        sessions = self._getSessionsByHighlightSearch(request)
-        # Return individual SessionForm object per Session
+        """Get list of sessions matching any or all of the given highlights."""
+        sessionKeys, nextPageToken = self._getSessionsByHighlightSearch(
+            request)
+        # Return individual SessionForm object per Session, rendering only
+        # those that aren't already in memcache
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=_getCachedForms(SessionForm, sessionKeys,
+                                  self._copySessionsToForms),
+            nextPageToken=nextPageToken
+        )
+
+    @endpoints.method(SEARCH_GET_REQUEST, SessionForms,
+            path='search/sessions',
+            http_method='GET',
+            name='searchSessions')
+    @instrumented
+    def searchSessions(self, request):
+        """Full-text search over session names and highlights, best match
+        first.
+        """
+        sessionKeys, nextPageToken = _searchPage('Session', request)
+        return SessionForms(
+            items=_getCachedForms(SessionForm, sessionKeys,
+                                  self._copySessionsToForms),
+            nextPageToken=nextPageToken
         )
 
     @endpoints.method(SESSION_SPEAKER_GET_REQUEST, SessionForms,
             path='sessions/speaker/{websafeSpeakerKey}',
             http_method='GET',
             name='getSessionsBySpeaker')
+    @instrumented
     def getSessionsBySpeaker(self, request):
         """Get list of sessions given by particular speaker."""
-        sessions = self._getSessionsBySpeaker(request)
-        # Return individual SessionForm object per Session
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        forms, nextPageToken = self._getSessionsBySpeaker(request)
+        return SessionForms(items=forms, nextPageToken=nextPageToken)
 
     @endpoints.method(SESSION_DOUBLE_INEQUALITY_GET_REQUEST, SessionForms,
             path='sessions/doubleinequality',
             http_method='GET',
             name='getSessionsDoubleInequalityDemo')
+    @instrumented
     def getSessionsDoubleInequalityDemo(self, request):
         """Demonstrates my solution to the double-inequality query problem."""
-        sessions = self._getSessionsDoubleInequalityDemo(request)
+        sessions, nextPageToken = self._getSessionsDoubleInequalityDemo(request)
         # Return individual SessionForm object per Session
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=nextPageToken
         )
 
-    @endpoints.method(SESSION_GET_REQUEST, BooleanMessage,
+    @endpoints.method(SESSION_QUERY_GET_REQUEST, SessionForms,
+            path='sessions/query',
+            http_method='GET',
+            name='querySessions')
+    @instrumented
+    def querySessions(self, request):
+        """Query sessions by conference, speaker, date range, start time
+        range, duration bounds and excluded types, in chronological order.
+        """
+        sessions, nextPageToken = self._querySessions(request)
+        # Return individual SessionForm object per Session
+        return SessionForms(
+            items=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=nextPageToken
+        )
+
+    @endpoints.method(SESSION_WISHLIST_POST_REQUEST, BooleanMessage,
             path='sessions/wishlist/{websafeSessionKey}',
             http_method='POST', name='addSessionToWishlist')
+    @instrumented
     def addSessionToWishlist(self, request):
         """Add a session to the user's wishlist."""
         return self._addSessionToWishlist(request)
@@ -938,21 +2606,50 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_GET_REQUEST, BooleanMessage,
             path='sessions/wishlist/{websafeSessionKey}',
             http_method='DELETE', name='removeSessionFromWishlist')
+    @instrumented
     def removeSessionFromWishlist(self, request):
         """Removes a session from the user's wishlist."""
         return self._removeSessionFromWishlist(request)
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(WishlistForm, BooleanMessage,
+            path='sessions/wishlist/add',
+            http_method='POST', name='addSessionsToWishlist')
+    @instrumented
+    def addSessionsToWishlist(self, request):
+        """Add several sessions to the user's wishlist at once."""
+        return BooleanMessage(
+            data=self._updateWishlist(request.websafeSessionKeys,
+                                      rejectConflicts=request.rejectConflicts))
+
+    @endpoints.method(WishlistForm, BooleanMessage,
+            path='sessions/wishlist/remove',
+            http_method='POST', name='removeSessionsFromWishlist')
+    @instrumented
+    def removeSessionsFromWishlist(self, request):
+        """Remove several sessions from the user's wishlist at once."""
+        return BooleanMessage(
+            data=self._updateWishlist(request.websafeSessionKeys, add=False))
+
+    @endpoints.method(WISHLIST_CONFLICTS_GET_REQUEST, SessionConflictForms,
+            path='sessions/wishlist/conflicts',
+            http_method='GET',
+            name='getWishlistConflicts')
+    @instrumented
+    def getWishlistConflicts(self, request):
+        """Get the pairs of sessions in the user's wishlist that overlap."""
+        return self._getWishlistConflicts(request)
+
+    @endpoints.method(WISHLIST_GET_REQUEST, SessionForms,
             path='sessions/wishlist',
             http_method='GET',
             name='getSessionsInWishlist')
+    @instrumented
     def getSessionsInWishlist(self, request):
-        """Get list of sessions in the user's wishlist."""
-        sessions = self._getSessionsInWishlist()
-        # Return individual SessionForm object per Session
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+        """Get list of sessions in the user's wishlist, optionally filtered
+        by conference.
+        """
+        forms, nextPageToken = self._getSessionsInWishlist(request)
+        return SessionForms(items=forms, nextPageToken=nextPageToken)
 
 ###############################################################################
 ###         Profiles: Private Methods
@@ -960,16 +2657,8 @@ class ConferenceApi(remote.Service):
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # Convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name,
-                            getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
+        pf = copyToForm(prof, ProfileForm)
+        pf.conferenceKeysToAttend = _getRegisteredConferenceKeys(prof)
         return pf
 
     def _doProfile(self, save_request=None):
@@ -977,16 +2666,61 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser()
         # If saveProfile(), process user-modifyable fields
         if save_request:
+            displayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
                     if val:
-                        print(val)
                         setattr(prof, field, str(val))
             prof.put()
+            # The organizer's display name is stored on all of their
+            # conferences, so have a task update them
+            if prof.displayName != displayName:
+                taskqueue.add(params={'email': prof.key.id()},
+                    url='/tasks/update_organizer_display_name'
+                )
         # Return ProfileForm
         return self._copyProfileToForm(prof)
 
+    @staticmethod
+    def _updateOrganizerDisplayName(userId, websafeCursor=None):
+        """Copy the profile's display name onto a batch of the conferences
+        it organizes, then queue the next batch; used by the task queued
+        when the display name changes.
+        """
+        prof = ndb.Key(Profile, userId).get()
+        if not prof:
+            return
+        # Ancestor query for the next batch of this organizer's conferences
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        confKeys, nextCursor, more = Conference.query(
+            ancestor=prof.key).fetch_page(
+                TASK_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        if confKeys:
+            _setOrganizerDisplayNameAsync(
+                confKeys, prof.displayName).get_result()
+        if more and nextCursor:
+            taskqueue.add(params={'email': userId,
+                'cursor': nextCursor.urlsafe()},
+                url='/tasks/update_organizer_display_name'
+            )
+
+    @staticmethod
+    def _migrateRegistrations(profiles):
+        """Convert the legacy conferenceKeysToAttend lists of a batch of
+        profiles into Registration entities; used by the registration
+        migration task.
+        """
+        # Each profile is its own entity group, so migrate them in
+        # parallel transactions
+        futures = [
+            _migrateRegistrationsAsync(prof.key)
+                for prof in profiles if prof.conferenceKeysToAttend
+        ]
+        ndb.Future.wait_all(futures)
+        for future in futures:
+            future.check_success()
+
     def _getProfileFromUser(self):
         """Return Profile from datastore, creating new one if non-existent."""
         # Make sure user is authenticated
@@ -1014,16 +2748,32 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @instrumented
     def saveProfile(self, request):
         """Update and return user profile."""
         return self._doProfile(request)
 
 
+# Register the backfill and migration tasks
+batchtask.registerTask('/tasks/backfill_organizer_display_names',
+                       Conference.query(),
+                       ConferenceApi._backfillOrganizerDisplayNames)
+batchtask.registerTask('/tasks/backfill_session_time_slots',
+                       Session.query(),
+                       ConferenceApi._backfillSessionTimeSlots)
+batchtask.registerTask('/tasks/migrate_registrations', Profile.query(),
+                       ConferenceApi._migrateRegistrations)
+batchtask.registerTask('/crons/reconcile_seats', Conference.query(),
+                       ConferenceApi._reconcileSeats)
+batchtask.registerTask('/tasks/migrate_speakers', Speaker.query(),
+                       ConferenceApi._migrateSpeakers)
+
 # Create the API
 api = endpoints.api_server([ConferenceApi])
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""
+converters.py -- Conference Central converters between NDB data models
+    and ProtoRPC form messages
+
+Each (model, message, view) combination is registered once at import time.
+Registration inspects the properties and fields a single time and builds
+specialized functions for both directions, so that copying an entity
+doesn't involve any per-field reflection or name checks.
+
+"""
+
+from datetime import datetime
+
+import endpoints
+from google.appengine.ext import ndb
+from protorpc import messages
+
+from models import AttendeeForm
+from models import CONF_POST_REQUEST
+from models import CONF_SUMMARY_FIELDS
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import SESSION_POST_REQUEST
+from models import SESSION_SUMMARY_FIELDS
+from models import Session
+from models import SessionForm
+from models import Speaker
+from models import SpeakerForm
+from models import SPEAKER_SUMMARY_FIELDS
+
+
+_TO_FORM = {}
+_FROM_FORM = {}
+
+
+def _dateToString(value):
+    """Converts a Date to a date string."""
+    return None if value is None else value.strftime('%Y-%m-%d')
+
+
+def _timeToString(value):
+    """Converts a Time to a time string."""
+    return None if value is None else value.strftime('%H:%M')
+
+
+def _stringToDate(value):
+    """Converts a date string to a Date."""
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def _stringToTime(value):
+    """Converts a time string to a Time."""
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def _toFormConverter(prop, field):
+    """Returns the function that converts a property value to a field value,
+    or None if the value can be copied verbatim.
+    """
+    if isinstance(prop, ndb.DateProperty):
+        return _dateToString
+    if isinstance(prop, ndb.TimeProperty):
+        return _timeToString
+    if isinstance(field, messages.EnumField):
+        # Enum values are stored as their names
+        enumType = field.type
+        return lambda value: None if value is None else enumType(value)
+    return None
+
+
+def _fromFormConverter(prop, field):
+    """Returns the function that converts a field value to a property value,
+    or None if the value can be copied verbatim.
+    """
+    if isinstance(prop, ndb.DateProperty):
+        return _stringToDate
+    if isinstance(prop, ndb.TimeProperty):
+        return _stringToTime
+    if isinstance(field, messages.EnumField):
+        # Store the string version of enum values
+        return str
+    return None
+
+
+def _buildToForm(model, formClass, fields=None):
+    """Builds a function that copies an entity of the model into a new
+    message of formClass.
+
+    If fields is given, only those fields (and websafeKey) are copied, which
+    allows the function to copy the results of projection queries.
+    """
+    copied = []
+    hasWebsafeKey = False
+    for field in formClass.all_fields():
+        name = field.name
+        prop = model._properties.get(name)
+        if name == 'websafeKey':
+            hasWebsafeKey = True
+        elif prop is not None and (fields is None or name in fields):
+            copied.append((name, _toFormConverter(prop, field)))
+
+    def toForm(entity):
+        values = {}
+        for name, converter in copied:
+            value = getattr(entity, name)
+            values[name] = converter(value) if converter else value
+        if hasWebsafeKey:
+            values['websafeKey'] = entity.key.urlsafe()
+        return formClass(**values)
+    return toForm
+
+
+def _buildFromForm(model, formClass):
+    """Builds a function that copies the fields of a formClass message that
+    exist on the model into a dict of property values.
+    """
+    fields = []
+    for field in formClass.all_fields():
+        prop = model._properties.get(field.name)
+        if prop is not None:
+            fields.append((field.name, _fromFormConverter(prop, field)))
+
+    def fromForm(form, defaults):
+        data = {}
+        for name, converter in fields:
+            value = getattr(form, name)
+            if value in (None, []):
+                value = defaults.get(name, value)
+            if converter and value not in (None, []):
+                try:
+                    value = converter(value)
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Invalid '%s' value" % name)
+            data[name] = value
+        return data
+    return fromForm
+
+
+def registerConverters(model, formClass, toForm=True, fromForm=True,
+                       view=None, fields=None):
+    """Builds and registers the converters between a model and a message.
+
+    Args:
+        model: NDB model class.
+        formClass: ProtoRPC message class.
+        toForm (bool): Whether to build the entity to message converter.
+        fromForm (bool): Whether to build the message to entity converter.
+        view (string): Name of the view, used to register converters for
+            the same pair that only copy some of the fields.
+        fields (tuple): Names of the fields the entity to message converter
+            copies. All matching fields are copied if None.
+    """
+    if toForm:
+        _TO_FORM[model, formClass, view] = _buildToForm(
+            model, formClass, fields)
+    if fromForm:
+        _FROM_FORM[model, formClass] = _buildFromForm(model, formClass)
+
+
+def copyToForm(entity, formClass, view=None):
+    """Copies an entity into a new message of formClass.
+
+    Args:
+        entity: NDB entity. The (model, formClass, view) combination must be
+            registered.
+        formClass: ProtoRPC message class.
+        view (string): Name of the registered view, if any.
+
+    Returns:
+        New formClass message. Fields that match a property of the entity
+        are converted, websafeKey is set to the entity's websafe key and all
+        other fields are left unset.
+    """
+    return _TO_FORM[type(entity), formClass, view](entity)
+
+
+def copyFromForm(form, model, defaults=None):
+    """Copies the fields of a message that match properties of a model into
+    a dict.
+
+    Args:
+        form: ProtoRPC message. The (model, message class) pair must be
+            registered.
+        model: NDB model class.
+        defaults (dict): Values, in message representation, used for the
+            fields that are empty.
+
+    Returns:
+        Dict mapping property names to converted values.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if a field can't be converted
+            to its property type.
+    """
+    return _FROM_FORM[model, type(form)](form, defaults or {})
+
+
+registerConverters(Conference, ConferenceForm)
+registerConverters(Conference, ConferenceForm, fromForm=False,
+                   view='summary', fields=CONF_SUMMARY_FIELDS)
+registerConverters(Conference, CONF_POST_REQUEST.combined_message_class,
+                   toForm=False)
+registerConverters(Profile, ProfileForm, fromForm=False)
+registerConverters(Profile, AttendeeForm, fromForm=False)
+registerConverters(Session, SessionForm)
+registerConverters(Session, SessionForm, fromForm=False,
+                   view='summary', fields=SESSION_SUMMARY_FIELDS)
+registerConverters(Session, SESSION_POST_REQUEST.combined_message_class,
+                   toForm=False)
+registerConverters(Speaker, SpeakerForm)
+registerConverters(Speaker, SpeakerForm, fromForm=False,
+                   view='summary', fields=SPEAKER_SUMMARY_FIELDS)
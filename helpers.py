@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+helpers.py -- Conference Central helpers shared by the API and the
+    session import tasks
+
+They live apart from conference.py, which imports sessionimport.py, so
+that both modules can import them.
+
+"""
+
+import time
+
+import endpoints
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SpeakerConferenceStats
+
+
+MEMCACHE_LOCK_TIME = 10
+MEMCACHE_AGENDA_PREFIX = "AGENDA:"
+FEATURED_SPEAKER_DELAY = 5
+
+
+def raiseIfWebsafeKeyNotValid(websafeKey, kind):
+    """Ensures that a websafe key is valid and of the desired kind.
+
+    Args:
+        websafeKey (string): Websafe key that is to be verified.
+        kind (string): Used to ensure that the websafe key represents the
+            desired kind. For example, "Session".
+
+    Returns:
+        If websafeKey is not None, is valid and is of the desired kind, then
+        the function returns the actual key. Otherwise, an exception is raised.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the websafeKey argument
+            is either equal to None, not able to be decoded or not of the
+            desired kind.
+    """
+    # Check that websafeKey is not None
+    if not websafeKey:
+        raise endpoints.BadRequestException(
+            "Websafe key not provided for '%s'" % kind)
+    # Try to decode the websafe key into a real key
+    try:
+        key = ndb.Key(urlsafe=websafeKey)
+    except:
+        raise endpoints.BadRequestException(
+            "Websafe key provided for '%s' could not be decoded: %s" %
+                (kind, websafeKey))
+    # Ensure that the key is of the desired kind
+    if key.kind() != kind:
+        raise endpoints.BadRequestException(
+            "Websafe key is not of the '%s' kind: %s" % (kind, websafeKey))
+    # If all is well, return the key
+    return key
+
+
+def invalidateAgenda(confKey):
+    """Removes the cached agenda of a conference once the transaction
+    commits.
+
+    The agenda can't be cached again for MEMCACHE_LOCK_TIME seconds, so that
+    it isn't rebuilt from query results that don't reflect the change yet.
+    """
+    key = MEMCACHE_AGENDA_PREFIX + confKey.urlsafe()
+    ndb.get_context().call_on_commit(
+        lambda: memcache.delete(key, seconds=MEMCACHE_LOCK_TIME))
+
+
+def speakerStatsKey(speakerKey, confKey):
+    """Returns the key of a speaker's session counter for a conference."""
+    return ndb.Key(SpeakerConferenceStats,
+                   '%s:%s' % (speakerKey.urlsafe(), confKey.urlsafe()))
+
+
+def scheduleFeaturedSpeakerUpdate(speakerKey, confKey):
+    """Schedules a task that makes the speaker the featured speaker.
+
+    Tasks are named after the speaker, conference and current time window,
+    so sessions added in bulk result in a single update.
+    """
+    websafeSpeakerKey = speakerKey.urlsafe()
+    websafeConferenceKey = confKey.urlsafe()
+    window = int(time.time()) // FEATURED_SPEAKER_DELAY
+    try:
+        taskqueue.add(
+            name='featured-%s-%s-%d' % (
+                websafeSpeakerKey, websafeConferenceKey, window),
+            params={'websafeSpeakerKey': websafeSpeakerKey,
+                    'websafeConferenceKey': websafeConferenceKey},
+            url='/tasks/update_featured_speaker',
+            countdown=FEATURED_SPEAKER_DELAY
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        # An update is already scheduled for this time window
+        pass
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+"""
+instrumentation.py -- Conference Central per-request RPC and latency
+    instrumentation
+
+Every API method decorated with @instrumented records its wall time along
+with the datastore, memcache and task queue RPCs it issued. RPCs are counted
+by a post-call hook on the API proxy. The most recent samples of each method
+are kept in memory on the instance and aggregated into percentiles by
+getStats(); when LOG_RPC_STATS is enabled, each sample is also logged as a
+JSON line for offline analysis.
+
+To aggregate across instances, each instance also counts its samples in
+histograms per WINDOW_SECONDS window and writes them to its own memcache
+slot every FLUSH_INTERVAL seconds. getAggregatedStats() merges the slots
+of all instances over the last REPORTED_WINDOWS windows into approximate
+percentiles, reported as the upper bound of the histogram bucket.
+
+"""
+
+import bisect
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+from settings import LOG_RPC_STATS
+
+
+MAX_SAMPLES = 1000
+PERCENTILES = (50, 90, 99)
+WINDOW_SECONDS = 600
+REPORTED_WINDOWS = 6
+FLUSH_INTERVAL = 10
+MEMCACHE_STATS_PREFIX = 'RPC_STATS:'
+# Upper bounds of the histogram buckets, about 19% apart, up to 2 ** 20
+BUCKET_BOUNDS = [0] + sorted(set(
+    int(round(2 ** (i / 4.0))) for i in range(81)))
+
+_local = threading.local()
+_lock = threading.Lock()
+_samples = {}
+# Histograms of the current window that this instance writes to memcache
+_window = None
+_slot = None
+_histograms = {}
+_lastFlush = 0
+
+
+def _newStats():
+    """Returns a dict with all counters of a call set to zero."""
+    return {
+        'datastoreGets': 0,
+        'datastorePuts': 0,
+        'datastoreDeletes': 0,
+        'datastoreQueries': 0,
+        'datastoreCommits': 0,
+        'entitiesRead': 0,
+        'entitiesWritten': 0,
+        'memcacheGets': 0,
+        'memcacheHits': 0,
+        'memcacheMisses': 0,
+        'memcacheSets': 0,
+        'memcacheDeletes': 0,
+        'tasksAdded': 0,
+    }
+
+
+def _countRpc(stats, service, call, request, response):
+    """Adds a completed RPC to the counters of the current call."""
+    if service == 'datastore_v3':
+        if call == 'Get':
+            stats['datastoreGets'] += 1
+            stats['entitiesRead'] += request.key_size()
+        elif call == 'Put':
+            stats['datastorePuts'] += 1
+            stats['entitiesWritten'] += request.entity_size()
+        elif call == 'Delete':
+            stats['datastoreDeletes'] += 1
+        elif call == 'RunQuery':
+            stats['datastoreQueries'] += 1
+            stats['entitiesRead'] += response.result_size()
+        elif call == 'Next':
+            stats['entitiesRead'] += response.result_size()
+        elif call == 'Commit':
+            stats['datastoreCommits'] += 1
+    elif service == 'memcache':
+        if call == 'Get':
+            hits = response.item_size()
+            stats['memcacheGets'] += 1
+            stats['memcacheHits'] += hits
+            stats['memcacheMisses'] += request.key_size() - hits
+        elif call == 'Set':
+            stats['memcacheSets'] += 1
+        elif call == 'Delete':
+            stats['memcacheDeletes'] += 1
+    elif service == 'taskqueue':
+        if call == 'Add':
+            stats['tasksAdded'] += 1
+        elif call == 'BulkAdd':
+            stats['tasksAdded'] += request.add_request_size()
+
+
+def _postCallHook(service, call, request, response):
+    """API proxy hook that counts RPCs issued by an instrumented call."""
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        return
+    try:
+        _countRpc(stats, service, call, request, response)
+    except Exception:
+        # Instrumentation must never break the call being measured
+        logging.exception('Failed to count %s.%s RPC', service, call)
+
+
+def _percentile(values, percentile):
+    """Returns the nearest-rank percentile of a sorted list of values."""
+    index = max(int(round(percentile / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def _bucket(value):
+    """Returns the index of the histogram bucket that counts a value."""
+    return min(bisect.bisect_left(BUCKET_BOUNDS, value),
+               len(BUCKET_BOUNDS) - 1)
+
+
+def _flush():
+    """Writes the histograms of the current window to this instance's
+    memcache slot, allocating the slot on the first write. Must be called
+    with the lock held.
+    """
+    global _slot, _lastFlush
+    _lastFlush = time.time()
+    if not _histograms:
+        return
+    try:
+        if _slot is None:
+            _slot = memcache.incr(
+                '%s%d:slots' % (MEMCACHE_STATS_PREFIX, _window),
+                initial_value=0)
+            if _slot is None:
+                return
+        memcache.set('%s%d:%d' % (MEMCACHE_STATS_PREFIX, _window, _slot),
+                     _histograms, time=WINDOW_SECONDS * (REPORTED_WINDOWS + 1))
+    except Exception:
+        # Instrumentation must never break the call being measured
+        logging.exception('Failed to write RPC stats to memcache')
+
+
+def _count(name, sample):
+    """Adds a sample of the named method to the histograms of the current
+    window, writing them to memcache when they are due. Must be called with
+    the lock held.
+    """
+    global _window, _slot, _histograms
+    now = time.time()
+    window = int(now // WINDOW_SECONDS)
+    if window != _window:
+        # Write out what is left of the previous window first
+        if _window is not None:
+            _flush()
+        _window, _slot, _histograms = window, None, {}
+    histogram = _histograms.setdefault(
+        name, {'calls': 0, 'errors': 0, 'counters': {}})
+    histogram['calls'] += 1
+    if sample['error']:
+        histogram['errors'] += 1
+    for counter in ['wallTimeMs'] + sorted(_newStats()):
+        buckets = histogram['counters'].setdefault(counter, {})
+        index = _bucket(sample[counter])
+        buckets[index] = buckets.get(index, 0) + 1
+    if now - _lastFlush >= FLUSH_INTERVAL:
+        _flush()
+
+
+def _record(name, sample):
+    """Stores a sample of the named method, logging it if enabled."""
+    with _lock:
+        if name not in _samples:
+            _samples[name] = deque(maxlen=MAX_SAMPLES)
+        _samples[name].append(sample)
+        _count(name, sample)
+    if LOG_RPC_STATS:
+        logging.info('rpc_stats %s', json.dumps(
+            dict(sample, method=name), sort_keys=True))
+
+
+def instrumented(func):
+    """Decorator that records wall time and RPC counts of an API method.
+
+    Must be applied below @endpoints.method, so that it wraps the method
+    itself.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Instrumented calls don't nest, but keep any outer counters intact
+        outer = getattr(_local, 'stats', None)
+        _local.stats = stats = _newStats()
+        start = time.time()
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error = e.__class__.__name__
+            raise
+        finally:
+            stats['wallTimeMs'] = (time.time() - start) * 1000.0
+            stats['error'] = error
+            _local.stats = outer
+            _record(func.__name__, stats)
+    return wrapper
+
+
+def getStats():
+    """Aggregates the samples recorded on this instance only; see
+    getAggregatedStats() for all instances.
+
+    Returns:
+        Dict mapping each method name to its number of samples, error
+        count, wall time percentiles, and the percentiles of each RPC
+        counter.
+    """
+    with _lock:
+        samples = dict((name, list(s)) for name, s in _samples.items())
+    result = {}
+    for name, calls in samples.items():
+        summary = {
+            'calls': len(calls),
+            'errors': sum(1 for call in calls if call['error']),
+        }
+        for counter in ['wallTimeMs'] + sorted(_newStats()):
+            values = sorted(call[counter] for call in calls)
+            summary[counter] = dict(
+                ('p%d' % p, _percentile(values, p)) for p in PERCENTILES)
+        result[name] = summary
+    return result
+
+
+def _histogramPercentile(buckets, total, percentile):
+    """Returns the upper bound of the bucket holding the nearest-rank
+    percentile of a histogram.
+    """
+    rank = max(int(round(percentile / 100.0 * total)), 1)
+    seen = 0
+    for index in sorted(buckets):
+        seen += buckets[index]
+        if seen >= rank:
+            return BUCKET_BOUNDS[index]
+    return BUCKET_BOUNDS[-1]
+
+
+def getAggregatedStats():
+    """Aggregates the histograms that all instances wrote to memcache over
+    the last REPORTED_WINDOWS windows, including this instance's latest
+    samples. Samples of instances that haven't written them yet, or whose
+    slots were evicted, are missing.
+
+    Returns:
+        Dict mapping each method name to its number of calls, error count,
+        wall time percentiles, and the percentiles of each RPC counter.
+    """
+    with _lock:
+        if _window is not None:
+            _flush()
+    current = int(time.time() // WINDOW_SECONDS)
+    windows = range(current - REPORTED_WINDOWS + 1, current + 1)
+    slotCounts = memcache.get_multi(['%d:slots' % w for w in windows],
+                                    key_prefix=MEMCACHE_STATS_PREFIX)
+    keys = [
+        '%d:%d' % (w, slot)
+            for w in windows
+                for slot in range(
+                    1, int(slotCounts.get('%d:slots' % w, 0)) + 1)
+    ]
+    merged = {}
+    for histograms in memcache.get_multi(
+            keys, key_prefix=MEMCACHE_STATS_PREFIX).values():
+        for name, histogram in histograms.items():
+            total = merged.setdefault(
+                name, {'calls': 0, 'errors': 0, 'counters': {}})
+            total['calls'] += histogram['calls']
+            total['errors'] += histogram['errors']
+            for counter, buckets in histogram['counters'].items():
+                totalBuckets = total['counters'].setdefault(counter, {})
+                for index, count in buckets.items():
+                    totalBuckets[index] = totalBuckets.get(index, 0) + count
+    result = {}
+    for name, total in merged.items():
+        summary = {'calls': total['calls'], 'errors': total['errors']}
+        for counter, buckets in total['counters'].items():
+            summary[counter] = dict(
+                ('p%d' % p,
+                 _histogramPercentile(buckets, total['calls'], p))
+                    for p in PERCENTILES)
+        result[name] = summary
+    return result
+
+
+def resetStats():
+    """Discards all samples recorded on this instance."""
+    with _lock:
+        _samples.clear()
+
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'instrumentation', _postCallHook)
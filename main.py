@@ -14,13 +14,28 @@ Modified by Richard Gieg on 12/2/2015 for Udacity Full Stack Project #4
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
-from time import sleep
+import json
 
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import users
 
+import batchtask
+import termindex
+import textsearch
 from conference import ConferenceApi
+from instrumentation import getAggregatedStats
+
+
+class RpcStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the API call percentiles of all instances over the last
+        hour.
+        """
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(getAggregatedStats(), indent=2,
+                                       sort_keys=True))
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
@@ -43,13 +58,91 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         ConferenceApi._cacheAnnouncement()
 
 
+class SyncSeatsAvailableHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy the seat shard totals into the conference."""
+        ConferenceApi._syncSeatsAvailable(
+            self.request.get('websafeConferenceKey'))
+
+
+class BatchTaskHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a backfill, migration or reconciliation task."""
+        batchtask.startTask(self.request.path)
+
+    def post(self):
+        """Continue a batch task with its next batch."""
+        batchtask.runBatch(
+            self.request.path,
+            self.request.get('kind'),
+            self.request.get('cursor')
+        )
+
+
+class UpdateOrganizerDisplayNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy a profile's display name onto its conferences."""
+        ConferenceApi._updateOrganizerDisplayName(
+            self.request.get('email'),
+            self.request.get('cursor')
+        )
+
+
+class ExportAttendeesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write the next batch of an attendee export."""
+        ConferenceApi._exportAttendees(
+            self.request.get('websafeExportKey'),
+            self.request.get('cursor'),
+            int(self.request.get('chunkId'))
+        )
+
+
+class ImportSessionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run the next step of a session import."""
+        ConferenceApi._importSessions(
+            self.request.get('websafeImportKey'),
+            int(self.request.get('step')),
+            int(self.request.headers.get('X-AppEngine-TaskRetryCount', 0))
+        )
+
+
+class DownloadAttendeeExportHandler(webapp2.RequestHandler):
+    def get(self, websafeExportKey):
+        """Download a finished attendee export as CSV (organizer only)."""
+        user = users.get_current_user()
+        export = ConferenceApi._getAttendeeExport(
+            websafeExportKey, user.email())
+        if not export:
+            self.abort(404)
+        if export.status != 'DONE':
+            self.abort(409, detail='The export is still running.')
+        self.response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+        self.response.headers['Content-Disposition'] = (
+            'attachment; filename="attendees-%d.csv"' % export.key.id())
+        for data in ConferenceApi._iterAttendeeExportChunks(export):
+            self.response.write(data)
+
+
+class UpdateTermIndexHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the topic/highlight postings of a conference or session."""
+        termindex.updateIndex(
+            self.request.get('websafeKey'),
+            self.request.get_all('term')
+        )
+
+
+class UpdateSearchDocumentHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write the search document of a conference, session or speaker."""
+        textsearch.updateDocument(self.request.get('websafeKey'))
+
+
 class UpdateFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Update the featured speaker."""
-        # Wait for eventual consistency to catch up, since new session was
-        # just added. Since this is running on a task queue thread the wait
-        # doesn't affect application responsiveness whatsoever.
-        sleep(3)
         # Call the routine that performs the logic for updating the featured
         # speaker.
         ConferenceApi._updateFeaturedSpeaker(
@@ -59,7 +152,23 @@ class UpdateFeaturedSpeakerHandler(webapp2.RequestHandler):
 
 
 app = webapp2.WSGIApplication([
+    ('/admin/rpc_stats', RpcStatsHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/reconcile_seats', BatchTaskHandler),
     ('/tasks/update_featured_speaker', UpdateFeaturedSpeakerHandler),
+    ('/tasks/migrate_speakers', BatchTaskHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/sync_seats_available', SyncSeatsAvailableHandler),
+    ('/tasks/update_organizer_display_name',
+        UpdateOrganizerDisplayNameHandler),
+    ('/tasks/backfill_organizer_display_names', BatchTaskHandler),
+    ('/tasks/migrate_registrations', BatchTaskHandler),
+    ('/tasks/export_attendees', ExportAttendeesHandler),
+    ('/exports/attendees/(.+)', DownloadAttendeeExportHandler),
+    ('/tasks/import_sessions', ImportSessionsHandler),
+    ('/tasks/update_term_index', UpdateTermIndexHandler),
+    ('/tasks/backfill_term_index', BatchTaskHandler),
+    ('/tasks/update_search_document', UpdateSearchDocumentHandler),
+    ('/tasks/backfill_search_documents', BatchTaskHandler),
+    ('/tasks/backfill_session_time_slots', BatchTaskHandler),
 ], debug=True)
@@ -15,6 +15,7 @@ Modified by Richard Gieg on 2015/12/20 for Udacity Full Stack Project #4
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 import httplib
+from datetime import date
 from datetime import time
 
 import endpoints
@@ -33,6 +34,7 @@ class Conference(ndb.Model):
     name = ndb.StringProperty(required=True)
     description = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty()
     topics = ndb.StringProperty(repeated=True)
     city = ndb.StringProperty()
     startDate = ndb.DateProperty()
@@ -42,6 +44,27 @@ class Conference(ndb.Model):
     seatsAvailable = ndb.IntegerProperty()
 
 
+class ConferenceSeatShard(ndb.Model):
+    """Seat reservation counter shard of a Conference."""
+    conference = ndb.KeyProperty(required=True)
+    capacity = ndb.IntegerProperty(default=0, indexed=False)
+    reserved = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class NearlySoldOutConference(ndb.Model):
+    """Conference listed in the announcement."""
+    conference = ndb.KeyProperty()
+    name = ndb.StringProperty()
+
+
+class Announcement(ndb.Model):
+    """Conferences that are nearly sold out. There is a single entity, kept
+    up to date as conferences cross the seat threshold.
+    """
+    conferences = ndb.LocalStructuredProperty(NearlySoldOutConference,
+                                              repeated=True)
+
+
 class ConferenceForm(messages.Message):
     """Conference inbound/outbound form message."""
     name = messages.StringField(1)
@@ -52,6 +75,9 @@ class ConferenceForm(messages.Message):
     startDate = messages.StringField(6)
     month = messages.IntegerField(7, variant=messages.Variant.INT32)
     maxAttendees = messages.IntegerField(8, variant=messages.Variant.INT32)
+    # Exact in getConference, which counts the seat shards. Listings and
+    # the announcement read the copy on the conference, which trails
+    # registrations by up to SEAT_SYNC_DELAY seconds.
     seatsAvailable = messages.IntegerField(9, variant=messages.Variant.INT32)
     endDate = messages.StringField(10)
     websafeKey = messages.StringField(11)
@@ -61,6 +87,8 @@ class ConferenceForm(messages.Message):
 class ConferenceForms(messages.Message):
     """Multiple Conference outbound form message."""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    queryPlan = messages.StringField(3)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -73,6 +101,20 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """Multiple ConferenceQueryForm inbound form message."""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
+    view = messages.EnumField('ListView', 4, default='FULL')
+    explain = messages.BooleanField(5)
+
+
+CONF_SUMMARY_FIELDS = (
+    "city",
+    "maxAttendees",
+    "name",
+    "organizerDisplayName",
+    "seatsAvailable",
+    "startDate",
+)
 
 
 CONF_DEFAULTS = {
@@ -97,7 +139,98 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
 
 CONF_TOPICS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
-    topics=messages.StringField(1, repeated=True)
+    topics=messages.StringField(1, repeated=True),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    match=messages.EnumField('MatchMode', 4, default='ANY'),
+)
+
+
+CONF_SESSIONS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    view=messages.EnumField('ListView', 4, default='FULL'),
+)
+
+
+class GroupRegistrationForm(messages.Message):
+    """Group registration inbound form message."""
+    emails = messages.StringField(1, repeated=True)
+
+
+class RegistrationResultForm(messages.Message):
+    """Registration result outbound form message."""
+    email = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    registered = messages.BooleanField(3)
+    message = messages.StringField(4)
+
+
+class RegistrationResultForms(messages.Message):
+    """Multiple RegistrationResultForm outbound form message."""
+    items = messages.MessageField(RegistrationResultForm, 1, repeated=True)
+
+
+CONF_GROUP_POST_REQUEST = endpoints.ResourceContainer(
+    GroupRegistrationForm,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+
+class AttendeeForm(messages.Message):
+    """Conference attendee outbound form message."""
+    displayName = messages.StringField(1)
+    mainEmail = messages.StringField(2)
+    teeShirtSize = messages.EnumField('TeeShirtSize', 3)
+
+
+class AttendeeForms(messages.Message):
+    """Multiple AttendeeForm outbound form message."""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+CONF_ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+
+class AttendeeExport(ndb.Model):
+    """CSV export of the attendee list of a conference. The rows are stored
+    in AttendeeExportChunk children.
+    """
+    conference = ndb.KeyProperty(required=True)
+    organizerUserId = ndb.StringProperty(required=True)
+    status = ndb.StringProperty(default='RUNNING')
+    attendeeCount = ndb.IntegerProperty(default=0, indexed=False)
+    chunkCount = ndb.IntegerProperty(default=0, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class AttendeeExportChunk(ndb.Model):
+    """One batch of CSV rows of an AttendeeExport. The ID is the 1-based
+    position of the batch.
+    """
+    data = ndb.BlobProperty(compressed=True)
+
+
+class AttendeeExportForm(messages.Message):
+    """Attendee export status outbound form message."""
+    websafeKey = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    status = messages.StringField(3)
+    attendeeCount = messages.IntegerField(4, variant=messages.Variant.INT32)
+    downloadUrl = messages.StringField(5)
+
+
+ATTENDEE_EXPORT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeExportKey=messages.StringField(1, required=True),
 )
 
 
@@ -113,9 +246,32 @@ class Speaker(ndb.Model):
     email = ndb.StringProperty(indexed=False)
     phone = ndb.StringProperty(indexed=False)
     websiteUrl = ndb.StringProperty(indexed=False)
+    # Legacy list of session keys, emptied by /tasks/migrate_speakers. An
+    # empty list isn't stored, so the property can be removed once every
+    # speaker is migrated.
     sessions = ndb.KeyProperty(repeated=True)
 
 
+class SpeakerConferenceStats(ndb.Model):
+    """Sessions of a speaker at one conference. The ID is the websafe key of
+    the speaker and the websafe key of the conference, joined by a colon.
+    """
+    speaker = ndb.KeyProperty(required=True)
+    conference = ndb.KeyProperty(required=True)
+    sessionCount = ndb.IntegerProperty(default=0)
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+    # IDs of the session imports whose sessions are already counted
+    importIds = ndb.IntegerProperty(repeated=True, indexed=False)
+
+
+class FeaturedSpeaker(ndb.Model):
+    """Featured speaker of a conference. The ID is the websafe key of the
+    conference.
+    """
+    speaker = ndb.KeyProperty(required=True)
+    message = ndb.StringProperty(indexed=False)
+
+
 class SpeakerForm(messages.Message):
     """Speaker inbound/outbound form message."""
     name = messages.StringField(1)
@@ -129,6 +285,13 @@ class SpeakerForm(messages.Message):
 class SpeakerForms(messages.Message):
     """Multiple Speaker outbound form message."""
     items = messages.MessageField(SpeakerForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+SPEAKER_SUMMARY_FIELDS = (
+    "company",
+    "name",
+)
 
 
 SPEAKER_DEFAULTS = {
@@ -150,6 +313,23 @@ SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
 ###############################################################################
 
 
+MINUTES_PER_DAY = 24 * 60
+
+# Date and start time stored for sessions created without them
+PLACEHOLDER_SESSION_DATE = date(1900, 1, 1)
+PLACEHOLDER_SESSION_START_TIME = time(0, 0)
+
+
+def toTimeSlot(day, startTime):
+    """Returns the time slot of a start date and time: the number of minutes
+    from the start of the calendar to that moment. Time slots order sessions
+    chronologically, so that a date range together with start times on its
+    first and last days is a single range of time slots.
+    """
+    return (day.toordinal() * MINUTES_PER_DAY +
+            startTime.hour * 60 + startTime.minute)
+
+
 class Session(ndb.Model):
     """Session object."""
     name = ndb.StringProperty(required=True)
@@ -160,6 +340,12 @@ class Session(ndb.Model):
     startTime = ndb.TimeProperty()
     speaker = ndb.KeyProperty(required=True)
     conference = ndb.KeyProperty(required=True)
+    # Undated sessions, including those stored with the placeholder date,
+    # have no time slot
+    timeSlot = ndb.ComputedProperty(
+        lambda self: toTimeSlot(self.date, self.startTime)
+            if self.date and self.startTime and
+                self.date != PLACEHOLDER_SESSION_DATE else None)
 
 
 class SessionForm(messages.Message):
@@ -176,6 +362,25 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """Multiple Session outbound form message."""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class AgendaSessionForm(messages.Message):
+    """Session of a conference agenda outbound form message."""
+    session = messages.MessageField(SessionForm, 1)
+    speaker = messages.MessageField(SpeakerForm, 2)
+
+
+class AgendaDayForm(messages.Message):
+    """Sessions of one day of a conference agenda outbound form message."""
+    date = messages.StringField(1)
+    sessions = messages.MessageField(AgendaSessionForm, 2, repeated=True)
+
+
+class AgendaForm(messages.Message):
+    """Conference agenda outbound form message."""
+    websafeConferenceKey = messages.StringField(1)
+    days = messages.MessageField(AgendaDayForm, 2, repeated=True)
 
 
 class SessionType(messages.Enum):
@@ -187,11 +392,20 @@ class SessionType(messages.Enum):
     WORKSHOP = 5
 
 
+SESSION_SUMMARY_FIELDS = (
+    "date",
+    "duration",
+    "name",
+    "startTime",
+    "typeOfSession",
+)
+
+
 SESSION_DEFAULTS = {
-    "date": "1900-01-01",
+    "date": PLACEHOLDER_SESSION_DATE.strftime('%Y-%m-%d'),
     "highlights": ["Default", "Highlight"],
     "duration": 60,
-    "startTime": "00:00",
+    "startTime": PLACEHOLDER_SESSION_START_TIME.strftime('%H:%M'),
     "typeOfSession": "NOT_SPECIFIED"
 }
 
@@ -213,18 +427,82 @@ SESSIONTYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1, required=True),
     typeOfSession=messages.EnumField(SessionType, 2, required=True),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4),
 )
 
 
 SESSION_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSpeakerKey=messages.StringField(1, required=True),
+    websafeConferenceKey=messages.StringField(2),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4),
+)
+
+
+SESSION_QUERY_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    websafeSpeakerKey=messages.StringField(2),
+    startDate=messages.StringField(3),
+    endDate=messages.StringField(4),
+    earliestStartTime=messages.StringField(5),
+    latestStartTime=messages.StringField(6),
+    minDuration=messages.IntegerField(7, variant=messages.Variant.INT32),
+    maxDuration=messages.IntegerField(8, variant=messages.Variant.INT32),
+    excludedTypes=messages.EnumField(SessionType, 9, repeated=True),
+    pageSize=messages.IntegerField(10, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(11),
+)
+
+
+SESSION_WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1, required=True),
+    rejectConflicts=messages.BooleanField(2, default=False),
+)
+
+
+class WishlistForm(messages.Message):
+    """Wishlist bulk update inbound form message. rejectConflicts only
+    applies to additions.
+    """
+    websafeSessionKeys = messages.StringField(1, repeated=True)
+    rejectConflicts = messages.BooleanField(2, default=False)
+
+
+class SessionConflictForm(messages.Message):
+    """Pair of overlapping wishlist sessions outbound form message."""
+    first = messages.MessageField(SessionForm, 1)
+    second = messages.MessageField(SessionForm, 2)
+
+
+class SessionConflictForms(messages.Message):
+    """Multiple SessionConflict outbound form message."""
+    items = messages.MessageField(SessionConflictForm, 1, repeated=True)
+
+
+WISHLIST_CONFLICTS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    registeredOnly=messages.BooleanField(1, default=False),
+)
+
+
+WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
 )
 
 
 SESSION_HIGHLIGHTS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
-    highlights=messages.StringField(1, repeated=True)
+    highlights=messages.StringField(1, repeated=True),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    match=messages.EnumField('MatchMode', 4, default='ANY'),
 )
 
 
@@ -232,6 +510,71 @@ SESSION_DOUBLE_INEQUALITY_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     maxStartTime=messages.StringField(1, required=True),
     sessionTypeToAvoid=messages.EnumField(SessionType, 2, required=True),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4),
+)
+
+
+class SessionImport(ndb.Model):
+    """Bulk import of sessions into a conference. The validated rows are
+    stored in SessionImportChunk children, each written by one task.
+    """
+    conference = ndb.KeyProperty(required=True)
+    organizerUserId = ndb.StringProperty(required=True)
+    status = ndb.StringProperty(default='RUNNING')
+    error = ndb.StringProperty(indexed=False)
+    rowCount = ndb.IntegerProperty(default=0, indexed=False)
+    importedCount = ndb.IntegerProperty(default=0, indexed=False)
+    chunkCount = ndb.IntegerProperty(default=0, indexed=False)
+    chunksDone = ndb.IntegerProperty(default=0, indexed=False)
+    # Sessions get the IDs firstSessionId + row index, so that retried
+    # tasks overwrite them instead of creating duplicates
+    firstSessionId = ndb.IntegerProperty(indexed=False)
+    # Speakers named by the rows (SpeakerForm fields plus a reserved ID),
+    # and the websafe keys their names resolved to
+    speakers = ndb.JsonProperty(compressed=True)
+    speakerKeys = ndb.JsonProperty(compressed=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class SessionImportChunk(ndb.Model):
+    """One batch of validated rows of a SessionImport. The ID is the
+    1-based position of the batch.
+    """
+    rows = ndb.JsonProperty(compressed=True)
+
+
+class ImportFormat(messages.Enum):
+    """Import data format enumeration value."""
+    CSV = 1
+    JSON = 2
+
+
+class SessionImportForm(messages.Message):
+    """Session bulk import inbound form message."""
+    format = messages.EnumField('ImportFormat', 1, default='CSV')
+    data = messages.StringField(2)
+
+
+class SessionImportStatusForm(messages.Message):
+    """Session bulk import status outbound form message."""
+    websafeKey = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    status = messages.StringField(3)
+    error = messages.StringField(4)
+    rowCount = messages.IntegerField(5, variant=messages.Variant.INT32)
+    importedCount = messages.IntegerField(6, variant=messages.Variant.INT32)
+
+
+SESSION_IMPORT_POST_REQUEST = endpoints.ResourceContainer(
+    SessionImportForm,
+    websafeConferenceKey=messages.StringField(1, required=True),
+)
+
+
+SESSION_IMPORT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeImportKey=messages.StringField(1, required=True),
 )
 
 
@@ -245,10 +588,20 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # Legacy list of websafe conference keys, superseded by Registration
+    # entities; emptied by the registration migration task
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionWishlist = ndb.KeyProperty(repeated=True)
 
 
+class Registration(ndb.Model):
+    """Registration of a user for a conference. The parent is the user's
+    Profile and the ID is the websafe key of the conference.
+    """
+    conference = ndb.KeyProperty(required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
 class ProfileForm(messages.Message):
     """Profile outbound form message."""
     displayName = messages.StringField(1)
@@ -287,6 +640,47 @@ class TeeShirtSize(messages.Enum):
 ###############################################################################
 
 
+PAGED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
+)
+
+
+SEARCH_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1, required=True),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+
+class ListView(messages.Enum):
+    """List view enumeration value."""
+    FULL = 1
+    SUMMARY = 2
+
+
+class MatchMode(messages.Enum):
+    """Multi-term search match mode enumeration value."""
+    ANY = 1
+    ALL = 2
+
+
+class TermIndex(ndb.Model):
+    """Lists the shards of the posting list of a term; only stored once one
+    of the initial shards has split.
+    """
+    shards = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class TermIndexShard(ndb.Model):
+    """Shard of the posting list of a term; holds the keys of the entities
+    that carry the term.
+    """
+    entityKeys = ndb.KeyProperty(repeated=True, indexed=False)
+
+
 class BooleanMessage(messages.Message):
     """Outbound Boolean value message"""
     data = messages.BooleanField(1)
@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+
+"""
+sessionimport.py -- Conference Central bulk import of sessions
+
+An import is validated and stored as a SessionImport with its rows split
+into SessionImportChunk entities, then run by a chain of tasks, one step
+per task: the first resolves the speakers named by the rows, each of the
+following writes one chunk of sessions, and the last updates the speaker
+counters and the featured speaker of the conference once.
+
+Session and speaker IDs are allocated up front and the steps are
+idempotent, so retried tasks don't create duplicates. A step that still
+fails after MAX_STEP_RETRIES retries fails the import.
+
+"""
+
+import csv
+import json
+import logging
+from cStringIO import StringIO
+
+import endpoints
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from protorpc import messages
+
+import termindex
+import textsearch
+from converters import copyFromForm
+from helpers import invalidateAgenda
+from helpers import raiseIfWebsafeKeyNotValid
+from helpers import scheduleFeaturedSpeakerUpdate
+from helpers import speakerStatsKey
+from models import ImportFormat
+from models import Session
+from models import SESSION_DEFAULTS
+from models import SessionForm
+from models import SessionImport
+from models import SessionImportChunk
+from models import SessionType
+from models import Speaker
+from models import SPEAKER_DEFAULTS
+from models import SpeakerConferenceStats
+from models import SpeakerForm
+
+
+IMPORT_BATCH_SIZE = 100
+MAX_IMPORT_ROWS = 2000
+MAX_IMPORT_ERRORS = 10
+MAX_STEP_RETRIES = 5
+IMPORT_SESSION_FIELDS = ('name', 'highlights', 'duration', 'typeOfSession',
+                         'date', 'startTime')
+# Maps the speaker columns of an import to SpeakerForm fields
+IMPORT_SPEAKER_COLUMNS = {
+    'speakerName': 'name',
+    'speakerCompany': 'company',
+    'speakerEmail': 'email',
+    'speakerPhone': 'phone',
+    'speakerWebsiteUrl': 'websiteUrl',
+}
+
+
+def _readImportRows(importFormat, data):
+    """Reads the rows of a session import.
+
+    Args:
+        importFormat (ImportFormat): Format of the data.
+        data (string): CSV text with a header row, or a JSON array of
+            objects, using the SessionForm field names and the columns of
+            IMPORT_SPEAKER_COLUMNS (or websafeSpeakerKey) as names.
+
+    Returns:
+        List of dicts mapping column names to values. Empty CSV cells are
+        left out.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the data can't be parsed.
+    """
+    if not data:
+        raise endpoints.BadRequestException("'data' field required")
+    if importFormat == ImportFormat.JSON:
+        try:
+            rows = json.loads(data)
+        except ValueError:
+            rows = None
+        if not (isinstance(rows, list) and
+                all(isinstance(row, dict) for row in rows)):
+            raise endpoints.BadRequestException(
+                "Invalid 'data' value: expected a JSON array of objects")
+        return rows
+    try:
+        reader = csv.DictReader(StringIO(data.encode('utf-8')))
+        # Cells beyond the header are collected under None, so skip them
+        return [
+            dict((column, value.decode('utf-8'))
+                 for column, value in row.items() if column and value)
+                for row in reader
+        ]
+    except csv.Error as e:
+        raise endpoints.BadRequestException("Invalid 'data' value: %s" % e)
+
+
+def _importSessionForm(row):
+    """Builds the SessionForm of an import row. Highlights may be a list or
+    a string of semicolon separated highlights.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if a value has the wrong
+            type.
+    """
+    form = SessionForm()
+    for name in IMPORT_SESSION_FIELDS:
+        value = row.get(name)
+        if value in (None, '', []):
+            continue
+        try:
+            if name == 'highlights' and isinstance(value, basestring):
+                value = [h.strip() for h in value.split(';') if h.strip()]
+            elif name == 'duration':
+                value = int(value)
+            elif name == 'typeOfSession':
+                value = SessionType(value)
+            setattr(form, name, value)
+        except (TypeError, ValueError, messages.Error):
+            raise endpoints.BadRequestException("Invalid '%s' value" % name)
+    return form
+
+
+def _importSpeakerFields(row):
+    """Returns the SpeakerForm fields given by the speaker columns of an
+    import row.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if a value has the wrong
+            type.
+    """
+    fields = dict((field, row[column])
+                  for column, field in IMPORT_SPEAKER_COLUMNS.items()
+                  if row.get(column))
+    try:
+        SpeakerForm(**fields)
+    except messages.Error:
+        raise endpoints.BadRequestException("Invalid speaker value")
+    return fields
+
+
+def _validateImportRows(rows):
+    """Checks the rows of a session import and collects the speakers that
+    they name.
+
+    Returns:
+        A tuple containing the rows, reduced to the import columns and
+        with their 0-based position under 'row', and the SpeakerForm fields
+        of each speaker named by the rows, in order of first appearance.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if there are no rows or too
+            many, or if rows are invalid. The message lists the first
+            MAX_IMPORT_ERRORS problems.
+    """
+    if not rows:
+        raise endpoints.BadRequestException(
+            'At least one row must be specified')
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise endpoints.BadRequestException(
+            'At most %d rows may be imported at once' % MAX_IMPORT_ROWS)
+    columns = IMPORT_SESSION_FIELDS + tuple(IMPORT_SPEAKER_COLUMNS) + (
+        'websafeSpeakerKey',)
+    errors = []
+    validRows = []
+    speakers = []
+    speakerNames = set()
+    speakerKeys = {}
+    for i, row in enumerate(rows):
+        try:
+            form = _importSessionForm(row)
+            if not form.name:
+                raise endpoints.BadRequestException(
+                    "Session 'name' field required")
+            # Converts the date and start time, as createSession does
+            copyFromForm(form, Session, SESSION_DEFAULTS)
+            if row.get('websafeSpeakerKey'):
+                speakerKeys[row['websafeSpeakerKey']] = (
+                    raiseIfWebsafeKeyNotValid(row['websafeSpeakerKey'],
+                                              'Speaker'))
+            elif row.get('speakerName'):
+                fields = _importSpeakerFields(row)
+                if fields['name'] not in speakerNames:
+                    speakerNames.add(fields['name'])
+                    speakers.append(fields)
+            else:
+                raise endpoints.BadRequestException(
+                    "'websafeSpeakerKey' or 'speakerName' field required")
+        except endpoints.BadRequestException as e:
+            errors.append('Row %d: %s' % (i + 1, e))
+            continue
+        validRow = dict((c, row[c]) for c in columns if c in row)
+        validRow['row'] = i
+        validRows.append(validRow)
+    # Verify that the referenced speakers exist with one batch get
+    for websafeKey, speaker in zip(speakerKeys,
+                                   ndb.get_multi(speakerKeys.values())):
+        if not speaker:
+            errors.append(
+                "No 'Speaker' entity found using websafe key: %s" %
+                    websafeKey)
+    if errors:
+        more = len(errors) - MAX_IMPORT_ERRORS
+        raise endpoints.BadRequestException('; '.join(
+            errors[:MAX_IMPORT_ERRORS] +
+            (['%d more problems' % more] if more > 0 else [])))
+    return (validRows, speakers)
+
+
+def _queueSessionImportStep(importKey, step):
+    """Queues the task that runs the given step of a session import: 0
+    resolves the speakers, 1 to chunkCount write the batches of sessions
+    and chunkCount + 1 finishes the import.
+
+    Tasks are named after the import and step, so a retried task can't
+    start a second chain of steps.
+    """
+    try:
+        taskqueue.add(
+            name='sessionimport-%d-%d' % (importKey.id(), step),
+            params={'websafeImportKey': importKey.urlsafe(), 'step': step},
+            url='/tasks/import_sessions'
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def _importRowSpeakerKey(sessionImport, row):
+    """Returns the key of the speaker of an import row."""
+    return ndb.Key(urlsafe=row.get('websafeSpeakerKey') or
+                   sessionImport.speakerKeys[row['speakerName']])
+
+
+@ndb.transactional()
+def _setSessionImportStatus(importKey, status, error=None):
+    """Sets the status of a session import."""
+    sessionImport = importKey.get()
+    sessionImport.status = status
+    sessionImport.error = error
+    sessionImport.put()
+
+
+def _resolveImportSpeakers(sessionImport):
+    """Looks up the speakers named by a session import, creating those that
+    don't exist yet, and stores the keys the names resolve to on the import.
+
+    A name shared by several existing speakers fails the import, since the
+    rows can't tell which one they mean.
+
+    Returns:
+        Whether the import can go on.
+    """
+    if sessionImport.speakerKeys is not None:
+        return True
+    # Look up all names in parallel
+    futures = [
+        Speaker.query(Speaker.name == speaker['fields']['name']).fetch_async(
+            3, keys_only=True)
+            for speaker in sessionImport.speakers
+    ]
+    speakerKeys = {}
+    newSpeakers = []
+    ambiguous = []
+    for speaker, future in zip(sessionImport.speakers, futures):
+        name = speaker['fields']['name']
+        ownKey = ndb.Key(Speaker, speaker['id'])
+        # A retried task may find the speaker it created before
+        found = [key for key in future.get_result() if key != ownKey]
+        if len(found) > 1:
+            ambiguous.append(name)
+        elif found:
+            speakerKeys[name] = found[0].urlsafe()
+        else:
+            data = copyFromForm(SpeakerForm(**speaker['fields']), Speaker,
+                                SPEAKER_DEFAULTS)
+            newSpeakers.append(Speaker(key=ownKey, **data))
+            speakerKeys[name] = ownKey.urlsafe()
+    if ambiguous:
+        _setSessionImportStatus(
+            sessionImport.key, 'FAILED',
+            'Several speakers are named %s; use websafeSpeakerKey instead' %
+                ', '.join(ambiguous))
+        return False
+    ndb.put_multi(newSpeakers)
+    for i in range(0, len(newSpeakers), IMPORT_BATCH_SIZE):
+        textsearch.putDocuments(newSpeakers[i:i + IMPORT_BATCH_SIZE])
+
+    @ndb.transactional()
+    def txn():
+        current = sessionImport.key.get()
+        current.speakerKeys = speakerKeys
+        current.put()
+    txn()
+    sessionImport.speakerKeys = speakerKeys
+    return True
+
+
+def _importSessionChunk(sessionImport, chunkId):
+    """Writes the sessions of one batch of a session import, along with
+    their search documents and term index postings, and records the
+    progress. A retried task rewrites the same sessions.
+    """
+    if chunkId <= sessionImport.chunksDone:
+        return
+    chunk = ndb.Key(SessionImportChunk, chunkId,
+                    parent=sessionImport.key).get()
+    sessions = []
+    for row in chunk.rows:
+        data = copyFromForm(_importSessionForm(row), Session,
+                            SESSION_DEFAULTS)
+        session = Session(id=sessionImport.firstSessionId + row['row'],
+                          **data)
+        session.conference = sessionImport.conference
+        session.speaker = _importRowSpeakerKey(sessionImport, row)
+        sessions.append(session)
+    ndb.put_multi(sessions)
+    # Index the whole batch at once, rather than with a task per session
+    textsearch.putDocuments(sessions)
+    termindex.indexEntities(sessions)
+
+    @ndb.transactional()
+    def txn():
+        current = sessionImport.key.get()
+        if chunkId <= current.chunksDone:
+            return
+        current.chunksDone = chunkId
+        current.importedCount += len(sessions)
+        current.put()
+    txn()
+
+
+@ndb.transactional_tasklet
+def _addImportedSessionsAsync(speakerKey, confKey, importId, sessionNames):
+    """Adds the sessions of an import to a speaker's session counter for a
+    conference, unless they were added before. Returns the session count.
+    """
+    statsKey = speakerStatsKey(speakerKey, confKey)
+    stats = yield statsKey.get_async()
+    if not stats:
+        stats = SpeakerConferenceStats(key=statsKey, speaker=speakerKey,
+                                       conference=confKey)
+    if importId not in stats.importIds:
+        stats.importIds.append(importId)
+        stats.sessionCount += len(sessionNames)
+        stats.sessionNames.extend(sessionNames)
+        yield stats.put_async()
+    raise ndb.Return(stats.sessionCount)
+
+
+def _finishSessionImport(sessionImport):
+    """Counts the imported sessions of each speaker, schedules a single
+    featured speaker update for the conference and marks the import as
+    done.
+    """
+    sessionNames = {}
+    for chunk in SessionImportChunk.query(ancestor=sessionImport.key):
+        for row in chunk.rows:
+            sessionNames.setdefault(
+                _importRowSpeakerKey(sessionImport, row), []).append(
+                    row['name'])
+    futures = dict(
+        (speakerKey, _addImportedSessionsAsync(
+            speakerKey, sessionImport.conference, sessionImport.key.id(),
+            names))
+            for speakerKey, names in sessionNames.items()
+    )
+    counts = dict((speakerKey, future.get_result())
+                  for speakerKey, future in futures.items())
+    # Feature the speaker with the most sessions at the conference, rather
+    # than updating the featured speaker once per speaker
+    featured = max(counts, key=counts.get)
+    if counts[featured] >= 2:
+        scheduleFeaturedSpeakerUpdate(featured, sessionImport.conference)
+    invalidateAgenda(sessionImport.conference)
+    _setSessionImportStatus(sessionImport.key, 'DONE')
+
+
+def createImport(conf, importFormat, data):
+    """Validates the rows of a bulk session import and stores them, then
+    starts the import tasks.
+
+    Args:
+        conf (Conference): Conference the sessions are imported into.
+        importFormat (ImportFormat): Format of the data.
+        data (string): Rows of the import; see _readImportRows.
+
+    Returns:
+        The new SessionImport.
+
+    Raises:
+        endpoints.BadRequestException: Occurs if the data can't be parsed
+            or rows are invalid.
+    """
+    rows, speakers = _validateImportRows(_readImportRows(importFormat, data))
+    # Reserve the IDs of the sessions and of the speakers that may have
+    # to be created, so that retried tasks don't create duplicates
+    importKey = ndb.Key(SessionImport, SessionImport.allocate_ids(1)[0])
+    firstSessionId, _ = Session.allocate_ids(len(rows))
+    firstSpeakerId = 0
+    if speakers:
+        firstSpeakerId, _ = Speaker.allocate_ids(len(speakers))
+    chunks = [
+        SessionImportChunk(parent=importKey, id=i // IMPORT_BATCH_SIZE + 1,
+                           rows=rows[i:i + IMPORT_BATCH_SIZE])
+            for i in range(0, len(rows), IMPORT_BATCH_SIZE)
+    ]
+    sessionImport = SessionImport(
+        key=importKey,
+        conference=conf.key,
+        organizerUserId=conf.organizerUserId,
+        rowCount=len(rows),
+        chunkCount=len(chunks),
+        firstSessionId=firstSessionId,
+        speakers=[
+            {'id': firstSpeakerId + i, 'fields': fields}
+                for i, fields in enumerate(speakers)
+        ]
+    )
+
+    # Store the import and its first task atomically, so that the
+    # import either runs or doesn't exist
+    @ndb.transactional()
+    def txn():
+        ndb.put_multi([sessionImport] + chunks)
+        taskqueue.add(
+            params={'websafeImportKey': importKey.urlsafe(), 'step': 0},
+            url='/tasks/import_sessions',
+            transactional=True
+        )
+    txn()
+    return sessionImport
+
+
+def getImport(websafeImportKey, userId):
+    """Returns the session import referenced by the websafe key if it
+    belongs to the given user, else None.
+    """
+    try:
+        sessionImport = ndb.Key(urlsafe=websafeImportKey).get()
+    except:
+        return None
+    if not isinstance(sessionImport, SessionImport):
+        return None
+    if sessionImport.organizerUserId != userId:
+        return None
+    return sessionImport
+
+
+def _runSessionImportStep(sessionImport, step):
+    """Runs one step of a session import, returning whether there is a next
+    step to queue.
+    """
+    if step == 0:
+        return _resolveImportSpeakers(sessionImport)
+    elif step <= sessionImport.chunkCount:
+        _importSessionChunk(sessionImport, step)
+        return True
+    _finishSessionImport(sessionImport)
+    return False
+
+
+def runStep(websafeImportKey, step, retryCount=0):
+    """Runs one step of a session import, then queues the next one; used by
+    the session import task.
+
+    Args:
+        websafeImportKey (string): Websafe key of the SessionImport.
+        step (int): Step to run; see _queueSessionImportStep.
+        retryCount (int): Number of times the task has been retried. An
+            error is raised again, so the task is retried, until it has been
+            retried MAX_STEP_RETRIES times; then the import fails with the
+            error instead.
+    """
+    importKey = ndb.Key(urlsafe=websafeImportKey)
+    sessionImport = importKey.get()
+    if not sessionImport or sessionImport.status != 'RUNNING':
+        return
+    try:
+        more = _runSessionImportStep(sessionImport, step)
+    except Exception as e:
+        if retryCount < MAX_STEP_RETRIES:
+            raise
+        logging.exception('Session import %d failed at step %d',
+                          importKey.id(), step)
+        _setSessionImportStatus(importKey, 'FAILED',
+                                'Step %d failed: %s' % (step, e))
+        return
+    if more:
+        _queueSessionImportStep(importKey, step + 1)
@@ -14,3 +14,6 @@ created/forked from conference.py by wesc on 2014 may 24
 # Console or Cloud Console.
 WEB_CLIENT_ID = '255361674432-br6rqpr6l2p9ndd9hbqfonrjnd0trj28.apps.googleusercontent.com'
 
+
+# Log the RPC counts and wall time of every API call as a JSON line
+LOG_RPC_STATS = False
@@ -414,6 +414,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.loadNextPage = null;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -423,12 +424,22 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Appends the next page of the conferences listed, if there is one.
+     */
+    $scope.loadMoreConferences = function () {
+        if ($scope.loadNextPage) {
+            $scope.loadNextPage();
+        }
+    };
+
     /**
      * Invokes the conference.queryConferences API.
      */
     $scope.queryConferencesAll = function () {
         var sendFilters = {
-            filters: []
+            filters: [],
+            view: 'SUMMARY'
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -441,8 +452,9 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
+        $scope.conferences = [];
         gapi.client.conference.queryConferences(sendFilters).
-            execute(function (resp) {
+            execute(function handlePage(resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
                     if (resp.error) {
@@ -454,14 +466,20 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                     } else {
                         // The request has succeeded.
                         $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
+                        $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters.filters);
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        // Only request the next page when the user asks for more.
+                        $scope.loadNextPage = resp.nextPageToken ? function () {
+                            $scope.loading = true;
+                            $scope.loadNextPage = null;
+                            sendFilters.pageToken = resp.nextPageToken;
+                            gapi.client.conference.queryConferences(sendFilters).execute(handlePage);
+                        } : null;
                     }
                     $scope.submitted = true;
                 });
@@ -473,8 +491,9 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
+        $scope.conferences = [];
         gapi.client.conference.getConferencesCreated().
-            execute(function (resp) {
+            execute(function handlePage(resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
                     if (resp.error) {
@@ -495,10 +514,17 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        // Only request the next page when the user asks for more.
+                        $scope.loadNextPage = resp.nextPageToken ? function () {
+                            $scope.loading = true;
+                            $scope.loadNextPage = null;
+                            gapi.client.conference.getConferencesCreated({
+                                pageToken: resp.nextPageToken
+                            }).execute(handlePage);
+                        } : null;
                     }
                     $scope.submitted = true;
                 });
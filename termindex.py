@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+"""
+termindex.py -- Conference Central inverted index of conference topics and
+    session highlights
+
+Maps each term to the keys of the entities that carry it, so that a search
+for several terms is a few batch gets instead of one query per term. The
+posting list of a term is split into TermIndexShard entities by the low
+bits of a hash of the entity key. A term starts out with
+2 ** INITIAL_SHARD_BITS shards, and a shard that grows past MAX_SHARD_SIZE
+keys is split in two on the next bit, so shards stay far below the entity
+size limit and the writes to a popular term spread over more entity groups
+as it grows. Once a shard has split, the TermIndex entity of the term lists
+its shards.
+
+Postings are updated by a task that reconciles the given terms with the
+current state of the entity, so the task can safely run more than once or
+out of order with other updates of the same entity.
+
+Search results are ranked once per query and kept in memcache in chunks
+behind the page token, so each following page only reads its own chunks.
+Terms whose posting list has split beyond MAX_SEARCH_SHARDS shards only
+contribute the postings of their widest shards, a sample picked by hash.
+
+"""
+
+import binascii
+import hashlib
+import os
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import batchtask
+from models import TermIndex
+from models import TermIndexShard
+
+
+INITIAL_SHARD_BITS = 3
+MAX_SHARD_SIZE = 5000
+# A search reads at most this many shards of each term, which caps the
+# candidates of terms that almost every entity carries, such as the default
+# topics
+MAX_SEARCH_SHARDS = 2 ** INITIAL_SHARD_BITS
+RESULTS_CHUNK_SIZE = 1000
+RESULTS_CACHE_TIME = 600
+MEMCACHE_RESULTS_PREFIX = 'TERM_SEARCH:'
+
+# The repeated property whose values are indexed, per kind
+INDEXED_PROPERTIES = {
+    'Conference': 'topics',
+    'Session': 'highlights',
+}
+
+
+def _indexKey(kind, term):
+    """Returns the key of the entity that lists the shards of a term."""
+    return ndb.Key(TermIndex, '%s:%s' % (kind, term))
+
+
+def _shardKey(kind, term, shard):
+    """Returns the key of one shard of a term's posting list."""
+    return ndb.Key(TermIndexShard, '%s:%s:%s' % (kind, term, shard))
+
+
+def _hashOf(key):
+    """Returns the hash of an entity key that places it in a shard."""
+    return zlib.crc32(key.urlsafe()) & 0xffffffff
+
+
+def _hashBits(value, count):
+    """Returns the low count bits of a hash as a string of 0s and 1s, which
+    names the shard at that depth.
+    """
+    return ''.join(str(value >> bit & 1) for bit in reversed(range(count)))
+
+
+def _shardsOf(index):
+    """Returns the shard names of a term, given its TermIndex entity or
+    None if none of its shards has split yet.
+    """
+    if index:
+        return list(index.shards)
+    return [_hashBits(i, INITIAL_SHARD_BITS)
+            for i in range(2 ** INITIAL_SHARD_BITS)]
+
+
+def _shardOf(key, shards):
+    """Returns the name of the shard that holds the postings of an entity.
+
+    The shard names of a term are the distinct suffixes of all hashes, so
+    exactly one of them matches.
+    """
+    value = _hashOf(key)
+    for shard in shards:
+        if _hashBits(value, len(shard)) == shard:
+            return shard
+
+
+def _terms(entity):
+    """Returns the set of indexed terms carried by an entity."""
+    return set(getattr(entity, INDEXED_PROPERTIES[entity.key.kind()]))
+
+
+@ndb.transactional_tasklet(xg=True)
+def _updateShardAsync(kind, term, shard, changes):
+    """Adds keys to or removes keys from one posting list shard, splitting
+    the shard if it grows past MAX_SHARD_SIZE.
+
+    Args:
+        kind (string): Kind of the indexed entities.
+        term (string): Term of the posting list.
+        shard (string): Name of the shard.
+        changes (list): (entity key, present) tuples, where present tells
+            whether the key must be in the posting list.
+
+    Returns:
+        The changes that weren't applied because the shard was split since
+        the caller picked it; empty otherwise.
+    """
+    indexKey = _indexKey(kind, term)
+    shardKey = _shardKey(kind, term, shard)
+    index, entity = yield ndb.get_multi_async([indexKey, shardKey])
+    shards = _shardsOf(index)
+    if shard not in shards:
+        raise ndb.Return(changes)
+    oldKeys = set(entity.entityKeys) if entity else set()
+    entityKeys = set(oldKeys)
+    for key, present in changes:
+        if present:
+            entityKeys.add(key)
+        else:
+            entityKeys.discard(key)
+    if entityKeys == oldKeys:
+        raise ndb.Return([])
+    if len(entityKeys) > MAX_SHARD_SIZE:
+        # Split the postings on the next hash bit, replacing the shard
+        halves = {}
+        for key in entityKeys:
+            halves.setdefault(_hashBits(_hashOf(key), len(shard) + 1),
+                              []).append(key)
+        shards.remove(shard)
+        shards.extend(['0' + shard, '1' + shard])
+        entities = [TermIndex(key=indexKey, shards=sorted(shards))]
+        for half, keys in halves.items():
+            entities.append(TermIndexShard(key=_shardKey(kind, term, half),
+                                           entityKeys=sorted(keys)))
+        yield ndb.put_multi_async(entities)
+        yield shardKey.delete_async()
+    elif entityKeys:
+        yield TermIndexShard(key=shardKey,
+                             entityKeys=sorted(entityKeys)).put_async()
+    else:
+        yield shardKey.delete_async()
+    raise ndb.Return([])
+
+
+def _applyChanges(changes):
+    """Applies posting changes, one transaction per shard, in parallel.
+
+    Changes that land on a shard that was split in the meantime are applied
+    again to the shards that replaced it.
+
+    Args:
+        changes (dict): Maps (kind, term) tuples to lists of
+            (entity key, present) tuples.
+    """
+    while changes:
+        terms = list(changes)
+        indexes = ndb.get_multi([_indexKey(*kindTerm) for kindTerm in terms])
+        futures = []
+        for (kind, term), index in zip(terms, indexes):
+            shards = _shardsOf(index)
+            shardChanges = {}
+            for key, present in changes[kind, term]:
+                shardChanges.setdefault(_shardOf(key, shards),
+                                        []).append((key, present))
+            for shard, pending in shardChanges.items():
+                futures.append(((kind, term),
+                    _updateShardAsync(kind, term, shard, pending)))
+        ndb.Future.wait_all([future for _, future in futures])
+        changes = {}
+        for kindTerm, future in futures:
+            retry = future.get_result()
+            if retry:
+                changes.setdefault(kindTerm, []).extend(retry)
+
+
+def scheduleIndexUpdate(key, terms):
+    """Queues a task that brings the postings of the given terms in line
+    with an entity.
+
+    The task is transactional when called inside a transaction, so the
+    index is only updated if the entity write commits.
+
+    Args:
+        key (ndb.Key): Key of the conference or session.
+        terms (list): Terms whose postings may have to change; both the old
+            and the new terms of an updated entity.
+    """
+    terms = sorted(set(term for term in terms if term))
+    if not terms:
+        return
+    taskqueue.add(params={'websafeKey': key.urlsafe(), 'term': terms},
+        url='/tasks/update_term_index',
+        transactional=ndb.in_transaction()
+    )
+
+
+def updateIndex(websafeKey, terms):
+    """Adds the entity to the postings of the given terms it carries and
+    removes it from those it doesn't; used by the index update task.
+    """
+    key = ndb.Key(urlsafe=websafeKey)
+    entity = key.get()
+    current = _terms(entity) if entity else set()
+    _applyChanges(dict(
+        ((key.kind(), term), [(key, term in current)])
+            for term in set(terms)
+    ))
+
+
+def indexEntities(entities):
+    """Adds entities to the postings of all the terms they carry.
+
+    The postings are grouped by shard, so each shard is written once no
+    matter how many of the entities it receives.
+
+    Args:
+        entities (list): Conferences or sessions.
+    """
+    changes = {}
+    for entity in entities:
+        for term in _terms(entity):
+            changes.setdefault((entity.key.kind(), term),
+                               []).append((entity.key, True))
+    _applyChanges(changes)
+
+
+def _searchShards(index):
+    """Returns the names of the shards of a term that a search reads: all
+    of them, or the MAX_SEARCH_SHARDS widest ones for very common terms.
+    """
+    shards = sorted(_shardsOf(index), key=lambda shard: (len(shard), shard))
+    return shards[:MAX_SEARCH_SHARDS]
+
+
+def _rank(kind, terms, matchAll):
+    """Returns the keys of the entities of a kind that carry the given
+    terms, ranked by the number of matching terms, most first, then by key.
+    """
+    indexKeys = [_indexKey(kind, term) for term in terms]
+    indexes = ndb.get_multi(indexKeys)
+    while True:
+        shardKeys = [
+            _shardKey(kind, term, shard)
+                for term, index in zip(terms, indexes)
+                    for shard in _searchShards(index)
+        ]
+        shards = ndb.get_multi(shardKeys)
+        # A shard that split while it was being read would be missed, so
+        # read again if the shards of any term changed
+        current = ndb.get_multi(indexKeys)
+        if ([_shardsOf(index) for index in current] ==
+                [_shardsOf(index) for index in indexes]):
+            break
+        indexes = current
+    # An entity appears in one shard per term, so counting its occurrences
+    # yields the number of terms it matches
+    matches = {}
+    for shard in shards:
+        if shard:
+            for key in shard.entityKeys:
+                matches[key] = matches.get(key, 0) + 1
+    if matchAll:
+        matches = dict((key, count) for key, count in matches.items()
+                       if count == len(terms))
+    return sorted(matches, key=lambda key: (-matches[key], key))
+
+
+def searchKeys(kind, terms, pageSize, pageToken=None, matchAll=False):
+    """Looks up a page of the entities of a kind that carry the given terms.
+
+    The first page ranks all matches and caches them in memcache under a
+    new results id, which the page token carries along with the offset of
+    the next page. Following pages only read the chunks of the cached
+    ranking they return; if those were evicted, the ranking is computed
+    and cached again.
+
+    Args:
+        kind (string): "Conference" or "Session".
+        terms (list): Terms to look up.
+        pageSize (int): Maximum number of results to return.
+        pageToken (string): Token of the page to return.
+        matchAll (bool): Whether entities must carry all of the terms,
+            rather than any of them.
+
+    Returns:
+        A tuple containing the entity keys ranked by the number of matching
+        terms, most first, then by key, and the token of the next page
+        (None if there are no more results).
+
+    Raises:
+        ValueError: Occurs if the page token isn't valid.
+    """
+    terms = sorted(set(terms))
+    if pageToken:
+        resultsId, _, offset = pageToken.partition(':')
+        if not resultsId.isalnum() or not offset.isdigit():
+            raise ValueError('Invalid page token: %s' % pageToken)
+        offset = int(offset)
+    else:
+        resultsId, offset = binascii.hexlify(os.urandom(8)), 0
+    # The query is part of the memcache key, so a token can't be used to
+    # read the results of another query
+    queryId = hashlib.sha1(repr((kind, terms, matchAll))).hexdigest()
+    prefix = '%s%s:%s:' % (MEMCACHE_RESULTS_PREFIX, queryId, resultsId)
+    end = offset + pageSize
+    chunks = range(offset // RESULTS_CHUNK_SIZE,
+                   (end - 1) // RESULTS_CHUNK_SIZE + 1)
+    cached = memcache.get_multi(['count'] + [str(c) for c in chunks],
+                                key_prefix=prefix)
+    count = cached.get('count')
+    if count is not None and all(str(c) in cached for c in chunks
+                                 if c * RESULTS_CHUNK_SIZE < count):
+        start = chunks[0] * RESULTS_CHUNK_SIZE
+        keys = []
+        for c in chunks:
+            keys.extend(cached.get(str(c), []))
+        page = keys[offset - start:end - start]
+    else:
+        ranked = _rank(kind, terms, matchAll)
+        count = len(ranked)
+        mapping = {'count': count}
+        for c in range(0, count, RESULTS_CHUNK_SIZE):
+            mapping[str(c // RESULTS_CHUNK_SIZE)] = (
+                ranked[c:c + RESULTS_CHUNK_SIZE])
+        memcache.set_multi(mapping, time=RESULTS_CACHE_TIME,
+                           key_prefix=prefix)
+        page = ranked[offset:end]
+    nextPageToken = '%s:%d' % (resultsId, end) if end < count else None
+    return (page, nextPageToken)
+
+
+# Existing entities are indexed by the backfill task
+for _kind in INDEXED_PROPERTIES:
+    batchtask.registerTask('/tasks/backfill_term_index',
+                           ndb.Query(kind=_kind), indexEntities)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""
+textsearch.py -- Conference Central full-text search over conferences,
+    sessions and speakers
+
+Each searchable entity is mirrored by a document in the Search API index of
+its kind, with the entity's websafe key as document ID. Documents are
+written by a task that renders the entity as it currently is, so the task
+can safely run more than once or out of order, and deleted entities lose
+their document.
+
+"""
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import batchtask
+
+
+MAX_SORT_LIMIT = 1000
+
+# Name of the search index holding the documents of each kind
+INDEX_NAMES = {
+    'Conference': 'conferences',
+    'Session': 'sessions',
+    'Speaker': 'speakers',
+}
+
+
+def _conferenceFields(conf):
+    """Returns the document fields of a conference."""
+    fields = [
+        search.TextField(name='name', value=conf.name),
+        search.TextField(name='description', value=conf.description),
+        search.TextField(name='topics', value=', '.join(conf.topics)),
+        search.TextField(name='city', value=conf.city),
+    ]
+    if conf.startDate:
+        fields.append(search.DateField(name='startDate', value=conf.startDate))
+    return fields
+
+
+def _sessionFields(session):
+    """Returns the document fields of a session."""
+    fields = [
+        search.TextField(name='name', value=session.name),
+        search.TextField(name='highlights',
+                         value=', '.join(session.highlights)),
+        search.AtomField(name='typeOfSession', value=session.typeOfSession),
+        search.AtomField(name='conference',
+                         value=session.conference.urlsafe()),
+    ]
+    if session.date:
+        fields.append(search.DateField(name='date', value=session.date))
+    return fields
+
+
+def _speakerFields(speaker):
+    """Returns the document fields of a speaker."""
+    return [
+        search.TextField(name='name', value=speaker.name),
+        search.TextField(name='company', value=speaker.company),
+    ]
+
+
+_FIELDS = {
+    'Conference': _conferenceFields,
+    'Session': _sessionFields,
+    'Speaker': _speakerFields,
+}
+
+
+def _document(entity):
+    """Renders an entity as a search document."""
+    return search.Document(
+        doc_id=entity.key.urlsafe(),
+        fields=_FIELDS[entity.key.kind()](entity)
+    )
+
+
+def scheduleDocumentUpdate(key):
+    """Queues a task that writes the search document of an entity.
+
+    The task is transactional when called inside a transaction, so the
+    document is only written if the entity write commits.
+
+    Args:
+        key (ndb.Key): Key of the conference, session or speaker.
+    """
+    taskqueue.add(params={'websafeKey': key.urlsafe()},
+        url='/tasks/update_search_document',
+        transactional=ndb.in_transaction()
+    )
+
+
+def putDocuments(entities):
+    """Writes the search documents of several entities of one kind with a
+    single call.
+
+    Args:
+        entities (list): At most 200 conferences, sessions or speakers, all
+            of the same kind.
+    """
+    if entities:
+        search.Index(name=INDEX_NAMES[entities[0].key.kind()]).put(
+            [_document(entity) for entity in entities])
+
+
+def updateDocument(websafeKey):
+    """Writes the search document of an entity, or deletes it if the entity
+    no longer exists; used by the document update task.
+    """
+    key = ndb.Key(urlsafe=websafeKey)
+    index = search.Index(name=INDEX_NAMES[key.kind()])
+    entity = key.get()
+    if entity:
+        index.put(_document(entity))
+    else:
+        index.delete(websafeKey)
+
+
+def searchKeys(kind, queryString, pageSize, pageToken=None):
+    """Runs a full-text query against the documents of a kind.
+
+    Args:
+        kind (string): "Conference", "Session" or "Speaker".
+        queryString (string): Query in the Search API query language.
+        pageSize (int): Maximum number of results to return.
+        pageToken (string): Websafe search cursor of the page to return.
+
+    Returns:
+        A tuple containing the keys of the matching entities, best match
+        first, and the token of the next page (None if there are no more
+        results).
+
+    Raises:
+        search.QueryError: Occurs if the query can't be parsed.
+        ValueError: Occurs if the page token isn't a valid cursor.
+    """
+    options = search.QueryOptions(
+        limit=pageSize,
+        cursor=search.Cursor(web_safe_string=pageToken),
+        ids_only=True,
+        # Rank by relevance to the query rather than document rank
+        sort_options=search.SortOptions(
+            match_scorer=search.MatchScorer(),
+            expressions=[search.SortExpression(
+                expression='_score',
+                direction=search.SortExpression.DESCENDING,
+                default_value=0.0)],
+            limit=MAX_SORT_LIMIT
+        )
+    )
+    results = search.Index(name=INDEX_NAMES[kind]).search(
+        search.Query(query_string=queryString, options=options))
+    nextPageToken = None
+    if results.cursor:
+        nextPageToken = results.cursor.web_safe_string
+    return ([ndb.Key(urlsafe=doc.doc_id) for doc in results.results],
+            nextPageToken)
+
+
+# Existing entities get their documents from the backfill task
+for _kind in INDEX_NAMES:
+    batchtask.registerTask('/tasks/backfill_search_documents',
+                           ndb.Query(kind=_kind), putDocuments)